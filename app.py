@@ -1,9 +1,18 @@
 import streamlit as st
-from supabase import create_client, Client
-import hashlib
+from supabase import create_client
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
 import datetime
+import math
+import threading
 import pendulum
+from bank_holidays import closed_days, week_dates
+from schedule import load_slots, is_reservation_allowed, week_eligibility, planning_week_count, planning_weeks
+from passwords import hash_password, verify_and_update
+from repositories import Repositories, USER_COLUMNS
+from bulk_io import (USER_CSV_COLUMNS, COURSE_CSV_COLUMNS, plan_users_import, plan_courses_import,
+                     apply_users_import, apply_courses_import, to_csv)
+from instrumentation import InstrumentedClient, QueryRecorder
 
 # Définir le fuseau horaire
 tz = pendulum.timezone("Europe/Paris")
@@ -36,139 +45,360 @@ with st.sidebar:
 # -------------------------
 # Config base de données
 # -------------------------
-supabase_url = st.secrets["supabase"]["url"]
-supabase_key = st.secrets["supabase"]["key"]
-supabase = create_client(supabase_url, supabase_key)
+def _query_context():
+    "Session, rerun and view of the query being recorded."
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return {}
+    return {"session": ctx.session_id[:8],
+            "rerun": st.session_state.get("_rerun"),
+            "view": st.session_state.get("_view")}
+
+@st.cache_resource
+def get_query_recorder():
+    "Timings of every Supabase query of the process (see the admin Système tab)."
+    return QueryRecorder(context=_query_context)
+
+@st.cache_resource
+def get_repositories():
+    "One Supabase client (and HTTP connection pool) for the whole process."
+    client = create_client(st.secrets["supabase"]["url"], st.secrets["supabase"]["key"])
+    return Repositories(InstrumentedClient(client, get_query_recorder()))
+
+repos = get_repositories()
+
+def run_concurrently(*calls):
+    """
+    repos.gather() for calls that may go through st.cache_data: the worker
+    threads get the script run context of the current session.
+    """
+    ctx = get_script_run_ctx()
+    def with_ctx(call):
+        def run():
+            add_script_run_ctx(threading.current_thread(), ctx)
+            return call()
+        return run
+    return repos.gather(*(with_ctx(call) for call in calls))
 
 # -------------------------
 # Helpers
 # -------------------------
-def hash_password(pw):
-    return hashlib.sha256(pw.encode()).hexdigest()
-
-def verify_password(pw, hashed):
-    return hash_password(pw) == hashed
-
 def get_weekdays():
     return ["Lundi","Mardi","Mercredi","Jeudi","Vendredi"]
 
-def is_bank_holiday_fr(date):
-    """
-    Return True if the given date (datetime.date or datetime.datetime) is a French bank holiday.
-    """
-    if isinstance(date, datetime.datetime):
-        date = date.date()
-    year = date.year
-
-    # Fixed-date holidays
-    fixed = [
-        (1, 1),    # New Year's Day
-        (5, 1),    # Labour Day
-        (5, 8),    # Victory in Europe Day
-        (7, 14),   # Bastille Day
-        (8, 15),   # Assumption of Mary
-        (11, 1),   # All Saints' Day
-        (11, 11),  # Armistice Day
-        (12, 25),  # Christmas
-    ]
-    if (date.month, date.day) in fixed:
-        return True
+# Number of weeks, starting from the current one, open for booking
+PLANNING_WEEKS = planning_week_count(st.secrets)
 
-    # Compute Easter Monday, Ascension, Pentecost Monday
-    def easter_date(y):
-        "Returns Easter as a date object."
-        a = y // 100
-        b = y % 100
-        c = (3 * (a + 25)) // 4
-        d = (3 * (a + 25)) % 4
-        e = (8 * (a + 11)) // 25
-        f = (5 * a + b) % 19
-        g = (19 * f + c - e) % 30
-        h = (f + 11 * g) // 319
-        j = (60 * (5 - d) + b) // 4
-        k = (60 * (5 - d) + b) % 4
-        m = (g - h + j + k) % 7
-        n = (g - h + j + k + 114) // 31
-        p = (g - h + j + k + 114) % 31
-        return datetime.date(y, n, p + 1)
-
-    easter = easter_date(year)
-    holidays = [
-        easter + datetime.timedelta(days=1),   # Easter Monday
-        easter + datetime.timedelta(days=39),  # Ascension
-        easter + datetime.timedelta(days=50),  # Pentecost Monday
-    ]
-
-
-def get_current_week_and_year():
-    now = pendulum.now(tz)
-
-    # If today is Saturday or Sunday, shift to next Monday
-    if now.weekday() in [5, 6]:
-        days_until_monday = 7 - now.weekday()
-        next_monday = now + datetime.timedelta(days=days_until_monday)
-        iso_info = next_monday.isocalendar()
-    else:
-        iso_info = now.isocalendar()
+def get_planning_weeks():
+    "The (week_num, year) of every week of the planning horizon."
+    return planning_weeks(pendulum.now(tz).date(), PLANNING_WEEKS)
 
-    # iso_info = (ISO_year, ISO_week, ISO_weekday)
-    return iso_info[1], iso_info[0]
+def format_week(week):
+    week_num, year = week
+    dates = week_dates(week_num, year)
+    return f"Semaine {week_num} ({dates[0]:%d/%m} - {dates[-1]:%d/%m})"
+
+def select_week(key):
+    "Week selector; only the selected week is loaded."
+    return st.selectbox("Semaine", get_planning_weeks(), format_func=format_week, key=key)
 
 # -------------------------
 # Users
 # -------------------------
-def get_user_by_email(email):
-    resp = supabase.table("users").select("*").eq("email", email).execute()
-    return resp.data[0] if resp.data else None
+def _store_session_user(user):
+    st.session_state["user"] = {k: user.get(k) for k in USER_COLUMNS} if user else None
+    if user:
+        st.session_state["user_version"] = _user_version(user["id"])
 
 def get_current_user():
-    if "user_id" in st.session_state:
-        resp = supabase.table("users").select("*").eq("id", st.session_state["user_id"]).execute()
-        return resp.data[0] if resp.data else None
-    return None
+    """
+    The logged-in user, cached in the session. It is only fetched again when
+    invalidate_user() was called for this user since it was stored.
+    """
+    if "user_id" not in st.session_state:
+        return None
+    user_id = st.session_state["user_id"]
+    if "user" not in st.session_state or st.session_state.get("user_version") != _user_version(user_id):
+        _store_session_user(repos.users.by_id(user_id))
+    return st.session_state["user"]
+
+def _user_version(user_id):
+    return (_cache_version(("user", user_id)), _cache_version("users"))
+
+def invalidate_user(user_id):
+    "Make every session of this user reload it on its next rerun."
+    _bump_cache_version(("user", user_id))
+
+def invalidate_users():
+    "Make every session reload its user (e.g. after a CSV import)."
+    _bump_cache_version("users")
 
 def login_user(email, password):
-    user = get_user_by_email(email)
-    if user and verify_password(password, user["password"]):
+    user = repos.users.by_email(email)
+    if not user:
+        return False
+    valid, new_hash = verify_and_update(password, user["password"])
+    if valid:
+        if new_hash:
+            # Legacy SHA-256 or outdated bcrypt cost: store the upgraded hash
+            repos.users.update(user["id"], {"password": new_hash})
         st.session_state["user_id"] = user["id"]
         st.session_state["role"] = user["role"]
+        _store_session_user(user)
         return True
     return False
 
-def is_reservation_allowed(weekday, start_time):
-    now = pendulum.now(tz)
-    current_weekday = now.weekday()  # 0 = Monday, 6 = Sunday
+# -------------------------
+# Cache
+# -------------------------
+# Course slots and weekly occupancy are shared by every session of the process.
+# Entries expire after CACHE_TTL seconds at most, and are dropped earlier by the
+# invalidate_* hooks, which bump the version that is part of the cache key.
+CACHE_TTL = 300
+
+@st.cache_resource
+def _cache_state():
+    return {"lock": threading.Lock(), "versions": {}, "calls": {}, "misses": {}}
+
+def _cache_version(key):
+    return _cache_state()["versions"].get(key, 0)
+
+def _bump_cache_version(key):
+    state = _cache_state()
+    with state["lock"]:
+        state["versions"][key] = state["versions"].get(key, 0) + 1
+
+def _count_cache(counter, name):
+    state = _cache_state()
+    with state["lock"]:
+        state[counter][name] = state[counter].get(name, 0) + 1
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=8, show_spinner=False)
+def _fetch_course_slots(version):
+    _count_cache("misses", "courseslot")
+    return repos.slots.list_all()
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=64, show_spinner=False)
+def _fetch_week_reservations(week_num, year, version, week_version):
+    _count_cache("misses", "reservation")
+    return repos.reservations.active_for_week(week_num, year)
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=64, show_spinner=False)
+def _fetch_week_roster(week_num, year, version, week_version):
+    _count_cache("misses", "roster")
+    return repos.reservations.roster_for_week(week_num, year)
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=8, show_spinner=False)
+def _fetch_closures(version):
+    _count_cache("misses", "closure")
+    return repos.slots.closures()
+
+def get_course_slots():
+    "All course slots, ordered by weekday and start time."
+    _count_cache("calls", "courseslot")
+    return _fetch_course_slots(_cache_version("courseslot"))
+
+@st.cache_resource(ttl=CACHE_TTL, max_entries=8, show_spinner=False)
+def _parse_course_slots(version):
+    return load_slots(_fetch_course_slots(version))
+
+def get_slot_models():
+    "All course slots as schedule.Slot objects, parsed once per version of the slots."
+    _count_cache("calls", "courseslot")
+    return _parse_course_slots(_cache_version("courseslot"))
+
+def get_week_reservations(week_num, year):
+    "Active (not cancelled) reservations of a week, confirmed and waitlisted."
+    _count_cache("calls", "reservation")
+    return _fetch_week_reservations(week_num, year, _cache_version("reservation"),
+                                    _cache_version(("reservation", week_num, year)))
+
+def get_week_roster(week_num, year):
+    """
+    Participants of every slot of a week, in a single joined query.
+    Return {course_id: {"confirmed": [nom, ...], "waitlist": [nom, ...]}},
+    each list in booking order.
+    """
+    _count_cache("calls", "roster")
+    rows = _fetch_week_roster(week_num, year, _cache_version("reservation"),
+                              _cache_version(("reservation", week_num, year)))
+    roster = {}
+    for r in rows:
+        entry = roster.setdefault(r["course_id"], {"confirmed": [], "waitlist": []})
+        nom = r["users"]["nom"] if r.get("users") else "Inconnu"
+        entry["waitlist" if r["waitlist"] else "confirmed"].append(nom)
+    return roster
+
+def get_closures():
+    "Club-specific closure dates, as {date: reason}."
+    _count_cache("calls", "closure")
+    return {datetime.date.fromisoformat(c["day"]): c["reason"]
+            for c in _fetch_closures(_cache_version("closure"))}
+
+def invalidate_course_slots():
+    _bump_cache_version("courseslot")
+
+def invalidate_week(week_num, year):
+    _bump_cache_version(("reservation", week_num, year))
+
+def invalidate_closures():
+    _bump_cache_version("closure")
+
+def invalidate_reservations():
+    "Drop the occupancy of every week (e.g. after a cascading delete)."
+    _bump_cache_version("reservation")
+
+def invalidate_schedule():
+    "Course slots and the occupancy of every week (capacity changes promote waitlists)."
+    invalidate_course_slots()
+    invalidate_reservations()
+
+def cache_stats():
+    state = _cache_state()
+    with state["lock"]:
+        return [{"cache": name, "hits": calls - state["misses"].get(name, 0),
+                 "misses": state["misses"].get(name, 0)}
+                for name, calls in sorted(state["calls"].items())]
 
-    # print(f"DEBUG: weekday = {weekday}, current_weekday = {current_weekday}")
+# -------------------------
+# Planning
+# -------------------------
+def build_week_planning(user_id, slots, reservations, eligibility):
+    """
+    Index the slots of a week listed in `eligibility` (see
+    schedule.week_eligibility) by weekday, as entries {"slot", "status",
+    "booked", "waitlisted", "my_reservation"}: the Slot, its eligibility
+    status, its confirmed/waitlist counts and the reservation of the given
+    user (or None).
+    """
+    by_course = {}
+    for r in reservations:
+        by_course.setdefault(r["course_id"], []).append(r)
+
+    planning = {idx: [] for idx in range(len(get_weekdays()))}
+    for slot in slots:
+        if slot.id not in eligibility:
+            continue
+        planning.setdefault(slot.weekday, []).append(
+            _slot_entry(slot, eligibility[slot.id], by_course.get(slot.id, []), user_id))
+    return planning
+
+def _slot_entry(slot, status, slot_res, user_id):
+    booked = sum(1 for r in slot_res if not r["waitlist"])
+    return {
+        "slot": slot,
+        "status": status,
+        "booked": booked,
+        "waitlisted": len(slot_res) - booked,
+        "my_reservation": next((r for r in slot_res if r["user_id"] == user_id), None),
+    }
+
+def reload_slot(entry, user_id, week_num, year):
+    "Fetch the week again and refresh an entry of build_week_planning() in place."
+    invalidate_week(week_num, year)
+    slot_res = [r for r in get_week_reservations(week_num, year) if r["course_id"] == entry["slot"].id]
+    entry.update(_slot_entry(entry["slot"], entry["status"], slot_res, user_id))
+
+def patch_slot(entry, status, user_id, week_num, year):
+    """
+    Apply the outcome of a booking or cancellation of `user_id` to an entry of
+    build_week_planning() in place. Outcomes whose effect is known are applied
+    without fetching the week again (the id of a new reservation isn't known,
+    see _on_cancel); otherwise the week is reloaded.
+    """
+    if status in ("confirmed", "waitlist"):
+        waitlist = status == "waitlist"
+        entry["waitlisted" if waitlist else "booked"] += 1
+        entry["my_reservation"] = {"id": None, "course_id": entry["slot"].id, "user_id": user_id,
+                                   "waitlist": waitlist}
+    elif status == "cancelled" and (entry["my_reservation"]["waitlist"] or not entry["waitlisted"]):
+        entry["waitlisted" if entry["my_reservation"]["waitlist"] else "booked"] -= 1
+        entry["my_reservation"] = None
+    elif status in ("cancelled", "already_booked", "not_found"):
+        # A freed place may or may not be taken from the waitlist (promote_waitlist
+        # skips users over quota or locked), and the other outcomes mean the
+        # card was out of date
+        reload_slot(entry, user_id, week_num, year)
+    elif status == "closed":
+        entry["status"] = "closed"
 
-    # --- NEXT WEEK SAT & SUN RULE ---
-    # If user selects Saturday (5) or Sunday (6), allow booking for *next* week
-    if current_weekday in [5, 6]:
-        return True
+# -------------------------
+# Statistiques
+# -------------------------
+ROLLUP_COLUMNS = ["course_id", "year", "week_num", "confirmed", "waitlisted", "cancelled"]
 
-    # --- SAME WEEK RULES ---
-    # If course is on a future day (Mon–Fri), reservation is allowed
-    if weekday > current_weekday:
-        return True
+@st.cache_data(ttl=CACHE_TTL, max_entries=8, show_spinner=False)
+def _fetch_attendance_rollup(first_year, last_year):
+    return repos.reservations.attendance_rollup(first_year, last_year, ROLLUP_COLUMNS)
 
-    # If course is on a past day of the week, reservation is not allowed
-    if weekday < current_weekday:
-        return False
+def get_season_rollup(season):
+    """
+    Per (course, week) rollups of the season starting in September of `season`,
+    joined to the course title and capacity.
+    """
+    df = pd.DataFrame(_fetch_attendance_rollup(season, season + 1), columns=ROLLUP_COLUMNS)
+    df["week_start"] = pd.to_datetime(df["year"].astype(str) + "-" + df["week_num"].astype(str) + "-1",
+                                      format="%G-%V-%u")
+    df = df[(df["week_start"] >= f"{season}-09-01") & (df["week_start"] < f"{season + 1}-08-01")]
+    slots = pd.DataFrame(get_course_slots(), columns=["id", "title", "weekday", "start_time", "capacity"])
+    df = df.merge(slots.rename(columns={"id": "course_id"}), on="course_id", how="left")
+    df["title"] = df["title"].fillna("Cours supprimé")
+    df["capacity"] = df["capacity"].fillna(0)
+    return df
+
+def course_stats(rollup):
+    "Fill rate, waitlist pressure and cancellation rate per course over the rollup."
+    stats = rollup.groupby(["course_id", "title", "weekday", "start_time"], dropna=False)[
+        ["confirmed", "waitlisted", "cancelled", "capacity"]].sum()
+    capacity = stats["capacity"].where(stats["capacity"] > 0)
+    stats["remplissage"] = stats["confirmed"] / capacity
+    stats["pression_attente"] = stats["waitlisted"] / capacity
+    stats["taux_annulation"] = stats["cancelled"] / (stats["confirmed"] + stats["cancelled"]).where(
+        lambda total: total > 0)
+    return stats.reset_index().sort_values(["weekday", "start_time"])
+
+def weekly_fill_rate(rollup):
+    # Deleted courses have no capacity: leave their bookings out too
+    weekly = rollup[rollup["capacity"] > 0].groupby("week_start")[["confirmed", "capacity"]].sum()
+    return (weekly["confirmed"] / weekly["capacity"].where(weekly["capacity"] > 0)).rename("remplissage")
 
-    # If course is today, check if it's at least 2 hours away
-    course_time_parts = start_time.split(':')
-    course_hour = int(course_time_parts[0])
-    course_minute = int(course_time_parts[1]) if len(course_time_parts) > 1 else 0
+# -------------------------
+# Réservations
+# -------------------------
+# Statuses returned by the book_reservation / cancel_reservation RPCs
+# (see supabase/migrations), mapped to the message shown to the user.
+BOOKING_MESSAGES = {
+    "confirmed": ("success", "Réservation confirmée"),
+    "waitlist": ("success", "Inscrit sur liste d'attente"),
+    "cancelled": ("success", "Réservation annulée"),
+    "already_booked": ("info", "Vous êtes déjà inscrit à ce cours"),
+    "quota_reached": ("error", "Limite de réservations atteinte pour votre formule."),
+    "bank_holiday": ("error", "Impossible de réserver : ce jour est un jour férié."),
+    "club_closed": ("error", "Impossible de réserver : le club est fermé ce jour-là."),
+    "closed": ("error", "Cours déjà passé ou dans moins de 2h"),
+    "not_found": ("error", "Réservation ou cours introuvable"),
+}
+
+def book_slot(user_id, course_id, week_num, year):
+    """
+    Book a slot in a single transactional call: the server checks capacity, the
+    formula limit, bank holidays and the 2-hour rule, and confirms the booking
+    or puts the user on the waitlist.
+    """
+    status = repos.reservations.book(user_id, course_id, week_num, year)
+    if status in ("confirmed", "waitlist"):
+        invalidate_week(week_num, year)
+    return status
 
-    course_datetime = now.replace(hour=course_hour, minute=course_minute, second=0, microsecond=0)
-    time_difference = (course_datetime - now).total_seconds() / 3600  # difference in hours
+def cancel_booking(user_id, reservation_id, week_num, year):
+    status = repos.reservations.cancel(reservation_id, user_id)
+    if status == "cancelled":
+        invalidate_week(week_num, year)
+    return status
 
-    # Allow booking/cancellation only if course is at least 2 hours away and hasn't started yet
-    # print(f"DEBUG: now = {now}, course_datetime = {course_datetime}, time_difference = {time_difference}")
-    if now < course_datetime:
-        return time_difference >= 2
-    else:
-        return False
+def show_booking_status(status):
+    kind, message = BOOKING_MESSAGES.get(status, ("error", "Erreur inattendue"))
+    getattr(st, kind)(message)
 
 # -------------------------
 # UI Connexion
@@ -188,6 +418,98 @@ def login_ui():
 # -------------------------
 # UI Utilisateur
 # -------------------------
+# The planning of the selected week is kept in st.session_state["planning"]:
+# {"slots": {course_id: entry}, "days": {weekday: [course_id, ...]}} (entries
+# of build_week_planning), rebuilt from the shared caches on every full rerun.
+# A booking button only reruns its slot card (a fragment): its callback calls
+# the RPC and patches the entry in place, and the card then redraws itself and
+# the quota badge.
+def _planning_entry(course_id):
+    return st.session_state["planning"]["slots"][course_id]
+
+def quota_badge(placeholder, user):
+    confirmed = sum(1 for entry in st.session_state["planning"]["slots"].values()
+                    if entry["my_reservation"] and not entry["my_reservation"]["waitlist"])
+    placeholder.markdown(f"**Mes réservations cette semaine : {confirmed} / {user['formula']}**")
+
+def _start_fragment_run():
+    "Credit the queries of a slot card rerun to the user view (see _query_context)."
+    st.session_state["_rerun"] = st.session_state.get("_rerun", 0) + 1
+    st.session_state["_view"] = "user_view"
+
+def _on_book(user, course_id, week_num, year):
+    _start_fragment_run()
+    entry = _planning_entry(course_id)
+    if is_reservation_allowed(entry["slot"], week_num, year, pendulum.now(tz)):
+        status = book_slot(user["id"], course_id, week_num, year)
+    else:
+        status = "closed"
+    patch_slot(entry, status, user["id"], week_num, year)
+    st.session_state[f"booking_status_{course_id}"] = status
+
+def _on_cancel(user, course_id, week_num, year):
+    _start_fragment_run()
+    entry = _planning_entry(course_id)
+    if is_reservation_allowed(entry["slot"], week_num, year, pendulum.now(tz)):
+        # Reservations made since the last full rerun aren't loaded with their id
+        reservation_id = entry["my_reservation"]["id"] or \
+            repos.reservations.active_id(user["id"], course_id, week_num, year)
+        if reservation_id is None:
+            status = "not_found"
+        else:
+            status = cancel_booking(user["id"], reservation_id, week_num, year)
+    else:
+        status = "closed"
+    patch_slot(entry, status, user["id"], week_num, year)
+    st.session_state[f"booking_status_{course_id}"] = status
+
+@st.fragment
+def slot_card(user, course_id, week_num, year, badge):
+    st.session_state["_view"] = "user_view"
+    entry = _planning_entry(course_id)
+    slot = entry["slot"]
+    dispo = slot.capacity - entry["booked"]
+    st.markdown(f"**{slot.title} ({slot.start_time}-{slot.end_time})**")
+    st.write(f"Places restantes : {dispo}")
+    # Bank holidays and closures are shown for the whole day (see day_column)
+    closed = entry["status"] is not None
+
+    args = (user, course_id, week_num, year)
+    with st.form(f"res_{course_id}"):
+        if entry["my_reservation"]:
+            st.form_submit_button("Annuler",
+                                  use_container_width=True,
+                                  type="primary",
+                                  disabled=closed,
+                                  on_click=_on_cancel, args=args)
+            st.markdown("""
+            <style>
+            div[data-testid="stForm"] button[kind="primary"] {
+                background-color: green;
+                color: white;
+            }
+            </style>
+            """, unsafe_allow_html=True)
+        else:
+            label = "Réserver" if dispo > 0 else "Cours complet - Liste d'attente"
+            st.form_submit_button(label, disabled=closed, on_click=_on_book, args=args)
+
+    status = st.session_state.pop(f"booking_status_{course_id}", None)
+    if status:
+        show_booking_status(status)
+        quota_badge(badge, user)
+    elif closed:
+        st.caption(BOOKING_MESSAGES[entry["status"]][1])
+
+@st.fragment
+def day_column(user, idx, day, week_num, year, is_closed, badge):
+    st.markdown(f"### {day}")
+    if is_closed:
+        st.caption("Club fermé")
+        return
+    for course_id in st.session_state["planning"]["days"].get(idx, []):
+        slot_card(user, course_id, week_num, year, badge)
+
 def user_view(user):
     tabs = st.tabs(["Planning hebdo", "Mon compte"])
 
@@ -195,99 +517,25 @@ def user_view(user):
     with tabs[0]:
         st.subheader("Planning de la semaine (Lundi - Vendredi)")
         weekdays = get_weekdays()
+        target_week, current_year = select_week("user_week")
+        slots, reservations, closures = run_concurrently(
+            get_slot_models, lambda: get_week_reservations(target_week, current_year), get_closures)
+        # Every rule checked at once for the whole week; the booking RPC checks them again
+        eligibility = week_eligibility(slots, target_week, current_year, pendulum.now(tz),
+                                       closures.keys(), user.get("gym_douce_only", False))
+        planning = build_week_planning(user["id"], slots, reservations, eligibility)
+        st.session_state["planning"] = {
+            "slots": {e["slot"].id: e for day_entries in planning.values() for e in day_entries},
+            "days": {idx: [e["slot"].id for e in day_entries] for idx, day_entries in planning.items()},
+        }
+        badge = st.empty()
+        quota_badge(badge, user)
+        dates = week_dates(target_week, current_year, len(weekdays))
+        closed = closed_days(target_week, current_year, closures.keys(), len(weekdays))
         cols = st.columns(len(weekdays))
         for idx, day in enumerate(weekdays):
             with cols[idx]:
-                st.markdown(f"### {day}")
-                slots = supabase.table("courseslot").select("*").eq("weekday", idx).order("start_time").execute().data
-                target_week, current_year = get_current_week_and_year()
-                if user.get("gym_douce_only", False):
-                    slots = [s for s in slots if "gym douce" in s["title"].lower()]
-                for slot in slots:
-                    count_res = supabase.table("reservation").select("id", count="exact") \
-                        .eq("course_id", slot["id"]).eq("cancelled", False).eq("waitlist", False).eq("week_num", target_week).eq("year", current_year).execute().count
-                    dispo = slot["capacity"] - count_res
-                    st.markdown(f"**{slot['title']} ({slot['start_time']}-{slot['end_time']})**")
-                    st.write(f"Places restantes : {dispo}")
-
-                    already = supabase.table("reservation").select("*") \
-                        .eq("user_id", user["id"]) \
-                        .eq("course_id", slot["id"]) \
-                        .eq("cancelled", False) \
-                        .eq("week_num", target_week) \
-                        .eq("year", current_year) \
-                        .execute().data
-
-                    with st.form(f"res_{slot['id']}"):
-                        if already:
-                            current_weekday = pendulum.now(tz).weekday()
-                            is_past_day = idx < current_weekday
-                            # print(f"DEBUG Cancel: idx={idx}, current_weekday={current_weekday}, is_past_day={is_past_day}")
-
-                            cancel = st.form_submit_button("Annuler", 
-                                                            use_container_width=True,
-                                                            type="primary")
-                            st.markdown("""
-                            <style>
-                            div[data-testid="stForm"] button[kind="primary"] {
-                                background-color: green;
-                                color: white;
-                            }
-                            </style>
-                            """, unsafe_allow_html=True)
-                            if cancel:
-                                if is_reservation_allowed(idx, slot["start_time"]):
-                                    supabase.table("reservation").update({"cancelled": True}).eq("id", already[0]["id"]).execute()
-                                    st.success("Réservation annulée")
-                                    st.rerun()
-                                else:
-                                    st.info("Cours déjà passé ou dans moins d'2h - Annulation impossible")
-                            
-                        else:
-                            if dispo > 0:
-                                reserve = st.form_submit_button("Réserver")
-                                if reserve:
-                                    week_num, year = get_current_week_and_year()
-                                    week_res = supabase.table("reservation").select("id", count="exact") \
-                                        .eq("user_id", user["id"]).eq("cancelled", False).eq("waitlist", False).eq("week_num", week_num).eq("year", year).execute().count
-
-                                    if is_reservation_allowed(idx, slot["start_time"]):
-                                        if week_res < user["formula"]:
-                                            # Construire la date du cours
-                                            slot_date = datetime.date.fromisocalendar(year, week_num, slot['weekday'] + 1)
-                                            # Vérifier si c'est un jour férié
-                                            if is_bank_holiday_fr(slot_date):
-                                                st.error("Impossible de réserver : ce jour est un jour férié.")
-                                                st.rerun()
-                                            supabase.table("reservation").insert({
-                                                "user_id": user["id"],
-                                                "course_id": slot["id"],
-                                                "waitlist": False,
-                                                "cancelled": False,
-                                                "week_num": week_num,
-                                                "year": year
-                                            }).execute()
-
-                                            st.success("Réservation confirmée")
-                                            st.rerun()
-                                        else:
-                                            st.error("Limite de réservations atteinte pour votre formule.")
-                                    else:
-                                        st.error("Réservations fermées pour ce cours (cours dans moins de 2h).")
-                            else:
-                                wait = st.form_submit_button("Cours complet - Liste d'attente")
-                                if wait:
-                                    week_num, year = get_current_week_and_year()
-                                    supabase.table("reservation").insert({
-                                        "user_id": user["id"],
-                                        "course_id": slot["id"],
-                                        "waitlist": True,
-                                        "cancelled": False,
-                                        "week_num": week_num,
-                                        "year": year
-                                    }).execute()
-                                    st.success("Inscrit sur liste d'attente")
-                                    st.rerun()
+                day_column(user, idx, day, target_week, current_year, dates[idx] in closed, badge)
 
     # Mon compte
     with tabs[1]:
@@ -296,61 +544,136 @@ def user_view(user):
             new_pw = st.text_input("Nouveau mot de passe", type="password")
             submit_pw = st.form_submit_button("Changer")
             if submit_pw and new_pw:
-                supabase.table("users").update({"password": hash_password(new_pw)}).eq("id", user["id"]).execute()
+                repos.users.update(user["id"], {"password": hash_password(new_pw)})
+                invalidate_user(user["id"])
                 st.success("Mot de passe modifié")
+        calendar_link_ui(user)
+
+def calendar_link_ui(user, coach=False):
+    """
+    Subscription URL of the user's calendar feed (see ics_server.py), if the
+    feed server is configured. The secret token is only fetched on demand.
+    """
+    base_url = st.secrets.get("calendar", {}).get("url")
+    if not base_url:
+        return
+    with st.expander("S'abonner depuis un agenda"):
+        if st.button("Afficher mon lien d'abonnement", key=f"calendar_link_{'coach' if coach else 'user'}"):
+            token = repos.users.calendar_token(user["id"])
+            st.code(f"{base_url.rstrip('/')}/calendar/{token}{'/coach' if coach else ''}.ics", language=None)
+            st.caption("Ce lien est personnel : toute personne qui le connaît peut voir "
+                       + ("le planning des cours." if coach else "vos réservations."))
 
 # -------------------------
 # UI Coach
 # -------------------------
-def coach_view():
+def coach_view(user):
     st.subheader("Planning coach")
+    calendar_link_ui(user, coach=True)
     weekdays = get_weekdays()
+    target_week, target_year = select_week("coach_week")
     cols = st.columns(len(weekdays))
+    all_slots, roster, closures = run_concurrently(
+        get_course_slots, lambda: get_week_roster(target_week, target_year), get_closures)
+    dates = week_dates(target_week, target_year, len(weekdays))
+    closed = closed_days(target_week, target_year, closures.keys(), len(weekdays))
     for idx, day in enumerate(weekdays):
         with cols[idx]:
             st.markdown(f"### {day}")
-            target_week, target_year = get_current_week_and_year()
-            slots = supabase.table("courseslot").select("*").eq("weekday", idx).order("start_time").execute().data
+            if dates[idx] in closed:
+                st.caption("Club fermé")
+                continue
+            slots = [s for s in all_slots if s["weekday"] == idx]
             for slot in slots:
-                count_res = supabase.table("reservation").select("id", count="exact") \
-                    .eq("course_id", slot["id"]).eq("cancelled", False).eq("waitlist", False).eq("week_num", target_week).eq("year", target_year).execute().count
-                wait_count = supabase.table("reservation").select("id", count="exact") \
-                    .eq("course_id", slot["id"]).eq("cancelled", False).eq("waitlist", True).eq("week_num", target_week).eq("year", target_year).execute().count
+                participants = roster.get(slot["id"], {"confirmed": [], "waitlist": []})
+                count_res = len(participants["confirmed"])
                 st.markdown(f"**{slot['title']}** ({slot['start_time']}-{slot['end_time']})")
                 if count_res == 0:
                     st.markdown(f"<span style='color:red'>{count_res}/{slot['capacity']} réservés</span>", unsafe_allow_html=True)
                 else:
                     st.write(f"{count_res}/{slot['capacity']} réservés")
-                if count_res + wait_count > 0:
+                if participants["confirmed"] or participants["waitlist"]:
                     with st.expander(f"Voir utilisateurs ({count_res})"):
-
-                        res = supabase.table("reservation").select("*, users(*)") \
-                            .eq("course_id", slot["id"]) \
-                            .eq("cancelled", False) \
-                            .eq("week_num", target_week) \
-                            .eq("year", target_year) \
-                            .execute().data
-                        user_lines = []
-                        for r in res:
-                            user_name = r['users']['nom'] if 'users' in r and r['users'] else "Inconnu"
-                            waitlist = " (liste d'attente)" if r.get('waitlist', False) else ""
-                            st.markdown(f"- {user_name}{waitlist}")
+                        for user_name in participants["confirmed"]:
+                            st.markdown(f"- {user_name}")
+                        for user_name in participants["waitlist"]:
+                            st.markdown(f"- {user_name} (liste d'attente)")
 
 # -------------------------
 # UI Admin
 # -------------------------
+USERS_PAGE_SIZE = 50
+
+def _reset_user_page():
+    st.session_state["user_page"] = 1
+
+def search_users():
+    """
+    The page of users selected by the search widgets of the admin tab (read
+    from the session state, so it can be fetched before they are rendered).
+    Return (rows, total number of matching users).
+    """
+    search = st.session_state.get("user_search", "")
+    role = st.session_state.get("user_role")
+    page = st.session_state.get("user_page", 1)
+    users, count = repos.users.search(search, role, (page - 1) * USERS_PAGE_SIZE, USERS_PAGE_SIZE)
+    if not users and page > 1:
+        # Past the last page, e.g. after a deletion
+        st.session_state["user_page"] = max(1, math.ceil(count / USERS_PAGE_SIZE))
+        users, count = repos.users.search(search, role, (st.session_state["user_page"] - 1) * USERS_PAGE_SIZE,
+                                          USERS_PAGE_SIZE)
+    return users, count
+
+def import_export_ui(key, load_rows, columns, plan_import, apply_import, invalidate):
+    """
+    CSV export of the rows returned by `load_rows`, and CSV import: the
+    uploaded file is checked as a dry run (errors and diff shown), then written
+    on confirmation. The rows are only loaded on download or upload.
+    """
+    st.download_button("Exporter (CSV)", lambda: to_csv(load_rows(), columns), file_name=f"{key}.csv",
+                       mime="text/csv", key=f"export_{key}")
+    uploaded = st.file_uploader("Importer un fichier CSV", type="csv", key=f"import_{key}")
+    if uploaded is None:
+        return
+    plan = plan_import(uploaded, load_rows())
+    st.caption(f"{len(plan.creates)} création(s), {len(plan.updates)} modification(s), "
+               f"{plan.unchanged} ligne(s) inchangée(s)")
+    if plan.errors:
+        st.error(f"{len(plan.errors)} ligne(s) invalide(s), rien ne sera importé")
+        st.dataframe(pd.DataFrame(plan.errors, columns=["ligne", "erreur"]), hide_index=True)
+        return
+    if plan.creates:
+        st.markdown("Créations")
+        st.dataframe(pd.DataFrame(plan.creates).drop(columns="password", errors="ignore"),
+                     hide_index=True)
+    if plan.diff:
+        st.markdown("Modifications")
+        st.dataframe(pd.DataFrame(plan.diff).astype(str), hide_index=True)
+    if (plan.creates or plan.updates) and st.button("Appliquer l'import", key=f"apply_{key}"):
+        count = apply_import(repos, plan)
+        invalidate()
+        st.success(f"{count} ligne(s) importée(s)")
+        st.rerun()
+
 def admin_view():
     st.subheader("Administration")
-    tabs = st.tabs(["Utilisateurs", "Cours"])
+    tabs = st.tabs(["Utilisateurs", "Cours", "Statistiques", "Système"])
+    # Independent reads of every tab, issued concurrently
+    (users, user_count), courses, closures, runs = run_concurrently(
+        search_users, get_course_slots, get_closures, repos.reservations.rollover_runs)
 
     # Utilisateurs
     with tabs[0]:
         st.subheader("Gestion des utilisateurs")
-        users = supabase.table("users").select("*").execute().data
-        df_users = pd.DataFrame(users)
-        # Drop the password column to avoid displaying sensitive information
-        df_users = df_users.drop(columns=['password'], errors='ignore')
-        st.dataframe(df_users)
+        col_search, col_role, col_page = st.columns([3, 1, 1])
+        col_search.text_input("Rechercher (nom ou email)", key="user_search", on_change=_reset_user_page)
+        col_role.selectbox("Rôle", [None, "user", "coach", "admin"], format_func=lambda r: r or "Tous",
+                           key="user_role", on_change=_reset_user_page)
+        col_page.number_input("Page", 1, max(1, math.ceil(user_count / USERS_PAGE_SIZE)), key="user_page")
+        st.caption(f"{user_count} utilisateur(s)")
+        # Only the current page, without the password hashes (see USER_COLUMNS)
+        df_users = pd.DataFrame(users, columns=USER_COLUMNS)
+        st.dataframe(df_users, hide_index=True)
 
         with st.expander("Ajouter un utilisateur"):
             with st.form("add_user"):
@@ -361,27 +684,27 @@ def admin_view():
                 formula = st.number_input("Formule (nb cours)",1,5,1)
                 gym_douce_only = st.checkbox("Accès uniquement Gym Douce", value=False)
                 if st.form_submit_button("Créer"):
-                    if get_user_by_email(email):
+                    if repos.users.by_email(email):
                         st.error("Email déjà utilisé")
                     else:
-                        supabase.table("users").insert({
+                        repos.users.insert({
                             "nom": nom,
                             "email": email,
                             "password": hash_password(pw),
                             "role": role,
                             "formula": formula,
                             "gym_douce_only": gym_douce_only
-                        }).execute()
+                        })
                         st.success("Utilisateur créé")
                         st.rerun()
 
         # --- Modifier / Supprimer utilisateur ---
         with st.expander("✏️ Modifier / Supprimer un utilisateur"):
-            user_ids = {u["nom"]: u["id"] for u in users}
-            if user_ids:
-                selected = st.selectbox("Choisir un utilisateur", list(user_ids.keys()))
-                user_id = user_ids[selected]
-                user_data = next(u for u in users if u["id"] == user_id)
+            users_by_id = {u["id"]: u for u in users}
+            if users_by_id:
+                user_id = st.selectbox("Choisir un utilisateur (page courante)", list(users_by_id),
+                                       format_func=lambda i: f"{users_by_id[i]['nom']} ({users_by_id[i]['email']})")
+                user_data = users_by_id[user_id]
 
                 with st.form("edit_user"):
                     nom = st.text_input("Nom", user_data["nom"])
@@ -393,25 +716,33 @@ def admin_view():
                     delete_btn = st.form_submit_button("🗑️ Supprimer")
 
                     if update_btn:
-                        supabase.table("users").update({
+                        repos.users.update(user_id, {
                             "nom": nom,
                             "email": email,
                             "role": role,
                             "formula": formula,
                             "gym_douce_only": gym_douce_only
-                        }).eq("id", user_id).execute()
+                        })
+                        invalidate_user(user_id)
                         st.success("Utilisateur mis à jour")
                         st.rerun()
 
                     if delete_btn:
-                        supabase.table("users").delete().eq("id", user_id).execute()
+                        repos.users.delete(user_id)
+                        invalidate_user(user_id)
+                        invalidate_reservations()
                         st.success("Utilisateur supprimé")
                         st.rerun()
 
+        with st.expander("Import / export CSV"):
+            st.caption("Colonnes : " + ", ".join(USER_CSV_COLUMNS) + ". Les membres sont reconnus "
+                       "par leur email ; le mot de passe n'est requis que pour les nouveaux.")
+            import_export_ui("utilisateurs", repos.users.iter_all, USER_CSV_COLUMNS, plan_users_import,
+                             apply_users_import, invalidate_users)
+
     # Cours
     with tabs[1]:
         st.subheader("Gestion des cours")
-        courses = supabase.table("courseslot").select("*").execute().data
         df_courses = pd.DataFrame(courses)
         st.dataframe(df_courses)
 
@@ -423,13 +754,14 @@ def admin_view():
                 end = st.text_input("Heure fin (HH:MM)")
                 cap = st.number_input("Capacité",1,50,10)
                 if st.form_submit_button("Créer le cours"):
-                    supabase.table("courseslot").insert({
+                    repos.slots.insert({
                         "title": title,
                         "weekday": weekday,
                         "start_time": start,
                         "end_time": end,
                         "capacity": cap
-                    }).execute()
+                    })
+                    invalidate_course_slots()
                     st.success("Cours ajouté")
                     st.rerun()
 
@@ -451,24 +783,111 @@ def admin_view():
                     delete_btn = st.form_submit_button("🗑️ Supprimer")
 
                     if update_btn:
-                        supabase.table("courseslot").update({
+                        repos.slots.update(course_id, {
                             "title": title,
                             "weekday": weekday,
                             "start_time": start,
                             "end_time": end,
                             "capacity": cap
-                        }).eq("id", course_id).execute()
+                        })
+                        invalidate_course_slots()
+                        if cap > course_data["capacity"]:
+                            # Waitlisted users are promoted by a database trigger
+                            invalidate_reservations()
                         st.success("Cours mis à jour")
                         st.rerun()
 
                     if delete_btn:
-                        supabase.table("courseslot").delete().eq("id", course_id).execute()
+                        repos.slots.delete(course_id)
+                        invalidate_course_slots()
+                        invalidate_reservations()
                         st.success("Cours supprimé")
                         st.rerun()
 
+        with st.expander("Import / export CSV"):
+            st.caption("Colonnes : " + ", ".join(COURSE_CSV_COLUMNS) + ". Les cours sont reconnus "
+                       "par leur id ; les lignes sans id sont créées.")
+            import_export_ui("cours", get_course_slots, COURSE_CSV_COLUMNS, plan_courses_import,
+                             apply_courses_import, invalidate_schedule)
+
+        # --- Fermetures du club ---
+        with st.expander("Fermetures du club"):
+            if closures:
+                st.dataframe(pd.DataFrame([{"jour": d, "motif": r} for d, r in closures.items()]))
+            with st.form("add_closure"):
+                day = st.date_input("Jour")
+                reason = st.text_input("Motif")
+                if st.form_submit_button("Ajouter la fermeture"):
+                    repos.slots.add_closure(day, reason)
+                    invalidate_closures()
+                    st.success("Fermeture ajoutée")
+                    st.rerun()
+            if closures:
+                with st.form("delete_closure"):
+                    day = st.selectbox("Jour", list(closures.keys()))
+                    if st.form_submit_button("🗑️ Supprimer la fermeture"):
+                        repos.slots.delete_closure(day)
+                        invalidate_closures()
+                        st.success("Fermeture supprimée")
+                        st.rerun()
+
+    # Statistiques
+    with tabs[2]:
+        st.subheader("Fréquentation")
+        today = datetime.date.today()
+        current_season = today.year if today.month >= 9 else today.year - 1
+        season = st.selectbox("Saison", list(range(current_season, current_season - 5, -1)),
+                              format_func=lambda y: f"{y}-{y + 1}")
+        rollup = get_season_rollup(season)
+        if rollup.empty:
+            st.info("Aucune réservation sur cette saison")
+        else:
+            stats = course_stats(rollup)
+            st.dataframe(stats[["title", "start_time", "confirmed", "waitlisted", "cancelled",
+                                "remplissage", "pression_attente", "taux_annulation"]],
+                         hide_index=True)
+            st.bar_chart(stats.set_index("title")[["remplissage", "pression_attente"]])
+            st.line_chart(weekly_fill_rate(rollup))
+
+    # Système
+    with tabs[3]:
+        st.subheader("Cache partagé")
+        st.caption(f"Durée de vie maximale des entrées : {CACHE_TTL} s")
+        st.dataframe(pd.DataFrame(cache_stats(), columns=["cache", "hits", "misses"]))
+        if st.button("Vider le cache"):
+            invalidate_course_slots()
+            invalidate_closures()
+            invalidate_reservations()
+            st.rerun()
+
+        st.subheader("Archivage hebdomadaire")
+        st.dataframe(pd.DataFrame(runs))
+
+        st.subheader("Requêtes Supabase")
+        recorder = get_query_recorder()
+        st.dataframe(pd.DataFrame(recorder.summary()), hide_index=True)
+        histogram = recorder.histogram()
+        st.dataframe(pd.DataFrame({"durée": list(histogram), "requêtes": list(histogram.values())}),
+                     hide_index=True)
+        events = pd.DataFrame(recorder.recent_events(), columns=["session", "rerun", "view", "ms"])
+        if not events.empty:
+            st.markdown("Reruns les plus lents")
+            reruns = events.groupby(["session", "rerun", "view"], dropna=False) \
+                .agg(requetes=("ms", "size"), total_ms=("ms", "sum")) \
+                .sort_values("total_ms", ascending=False).head(20)
+            st.dataframe(reruns.reset_index(), hide_index=True)
+        col_export, col_reset = st.columns(2)
+        col_export.download_button("Exporter (JSON)", recorder.export(),
+                                   file_name="supabase_queries.json", mime="application/json")
+        if col_reset.button("Remettre à zéro"):
+            recorder.reset()
+            st.rerun()
+
 # -------------------------
 # Main
 # -------------------------
+st.session_state["_rerun"] = st.session_state.get("_rerun", 0) + 1
+st.session_state["_view"] = "main"
 user = get_current_user()
 
 tabs = st.tabs(["Connexion","Utilisateur","Coach","Admin"])
@@ -484,18 +903,21 @@ with tabs[0]:
 
 with tabs[1]:
     if user and user["role"] in ["user","admin"]:
+        st.session_state["_view"] = "user_view"
         user_view(user)
     else:
         st.warning("Accès réservé aux utilisateurs")
 
 with tabs[2]:
     if user and user["role"] in ["coach","admin"]:
-        coach_view()
+        st.session_state["_view"] = "coach_view"
+        coach_view(user)
     else:
         st.warning("Accès réservé aux coachs")
 
 with tabs[3]:
     if user and user["role"]=="admin":
+        st.session_state["_view"] = "admin_view"
         admin_view()
     else:
         st.warning("Accès réservé aux admins")
@@ -0,0 +1,73 @@
+"""
+French bank holiday calendar.
+
+The holidays of a year are computed once and memoized as a frozenset of
+dates, so checking a day is a single set lookup.
+"""
+import datetime
+from functools import lru_cache
+
+# (month, day)
+FIXED_HOLIDAYS = (
+    (1, 1),    # New Year's Day
+    (5, 1),    # Labour Day
+    (5, 8),    # Victory in Europe Day
+    (7, 14),   # Bastille Day
+    (8, 15),   # Assumption of Mary
+    (11, 1),   # All Saints' Day
+    (11, 11),  # Armistice Day
+    (12, 25),  # Christmas
+)
+
+# Days after Easter Sunday
+EASTER_OFFSETS = (
+    1,   # Easter Monday
+    39,  # Ascension
+    50,  # Pentecost Monday
+)
+
+def easter_date(year):
+    "Returns Easter Sunday of the given year as a date object."
+    a = year // 100
+    b = year % 100
+    c = (3 * (a + 25)) // 4
+    d = (3 * (a + 25)) % 4
+    e = (8 * (a + 11)) // 25
+    f = (5 * a + b) % 19
+    g = (19 * f + c - e) % 30
+    h = (f + 11 * g) // 319
+    j = (60 * (5 - d) + b) // 4
+    k = (60 * (5 - d) + b) % 4
+    m = (2 * j - k - g + h) % 7
+    n = (g - h + m + 114) // 31
+    p = (g - h + m + 114) % 31
+    return datetime.date(year, n, p + 1)
+
+@lru_cache(maxsize=None)
+def bank_holidays_fr(year):
+    "All French bank holidays of the given year."
+    easter = easter_date(year)
+    return frozenset(
+        [datetime.date(year, month, day) for month, day in FIXED_HOLIDAYS]
+        + [easter + datetime.timedelta(days=offset) for offset in EASTER_OFFSETS]
+    )
+
+def is_bank_holiday_fr(date):
+    """
+    Return True if the given date (datetime.date or datetime.datetime) is a French bank holiday.
+    """
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return date in bank_holidays_fr(date.year)
+
+def week_dates(week_num, year, days=5):
+    "Dates of the first `days` days (Monday first) of an ISO week."
+    return [datetime.date.fromisocalendar(year, week_num, idx + 1) for idx in range(days)]
+
+def closed_days(week_num, year, closures=frozenset(), days=5):
+    """
+    Dates of an ISO week on which the club is closed: bank holidays plus the
+    club-specific closure dates given in `closures`.
+    """
+    return frozenset(d for d in week_dates(week_num, year, days)
+                     if d in closures or d in bank_holidays_fr(d.year))
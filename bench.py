@@ -0,0 +1,165 @@
+"""
+Offline benchmark of the booking flows.
+
+Runs app.py through streamlit.testing's AppTest against an in-memory
+fake_supabase.FakeClient (a club of --members members and --slots weekly
+slots, every query delayed by --latency ms) and reports, for the member,
+coach and admin flows:
+
+- the number of Supabase round trips of a cold and a warm render,
+- p50/p95 render and booking latency over --sessions concurrent sessions.
+
+AppTest is not thread-safe, so concurrency is simulated: all the sessions
+are open at the same time and their reruns are interleaved in random order
+on the same process, sharing the caches and the fake database, like the
+sessions of one Streamlit server.
+
+AppTest also reruns the whole script when a button of a fragment (the slot
+cards of the planning) is clicked, so the booking latency measured here is an
+upper bound of the one of a browser session.
+
+Exits with status 1 when a measure exceeds its threshold (THRESHOLDS), so it
+can be used as the baseline for every performance change.
+
+    python bench.py [--sessions 80] [--latency 20] [--json bench.json]
+"""
+import argparse
+import json
+import pathlib
+import random
+import sys
+import time
+from streamlit.testing.v1 import AppTest
+from fake_supabase import FakeClient
+
+APP_PATH = str(pathlib.Path(__file__).parent / "app.py")
+
+# Maximum accepted value of each measure
+THRESHOLDS = {
+    "member.cold_round_trips": 4,
+    "member.warm_round_trips": 1,
+    "coach.warm_round_trips": 1,
+    "admin.warm_round_trips": 4,
+    "member.render_p95_ms": 1500,
+    "member.booking_p95_ms": 1500,
+    "coach.render_p95_ms": 1500,
+}
+
+# Fake client used by the app runs (see _app)
+CLIENT = None
+
+def _app():
+    import runpy
+    import supabase
+    import bench
+    supabase.create_client = lambda url, key: bench.CLIENT
+    runpy.run_path(bench.APP_PATH, run_name="__main__")
+
+def seed_club(members, slots, latency):
+    "A fake club: members plus one coach and one admin, and `slots` weekly slots."
+    users = [{"nom": f"Membre {i}", "email": f"membre{i}@example.com", "password": "-",
+              "role": "user", "formula": random.choice([1, 2, 3]), "gym_douce_only": False}
+             for i in range(members)]
+    users += [{"nom": "Coach", "email": "coach@example.com", "password": "-", "role": "coach",
+               "formula": 5, "gym_douce_only": False},
+              {"nom": "Admin", "email": "admin@example.com", "password": "-", "role": "admin",
+               "formula": 5, "gym_douce_only": False}]
+    courses = [{"title": "Gym douce" if i % 5 == 4 else "Boxe", "weekday": i % 5,
+                "start_time": f"{17 + (i // 5) % 4}:30", "end_time": f"{18 + (i // 5) % 4}:30",
+                "capacity": 12}
+               for i in range(slots)]
+    return FakeClient({"users": users, "courseslot": courses}, latency=latency / 1000)
+
+def session(user_id):
+    at = AppTest.from_function(_app, default_timeout=60)
+    at.secrets["supabase"] = {"url": "http://localhost", "key": "bench"}
+    at.session_state["user_id"] = user_id
+    return at
+
+def timed_run(at):
+    start = time.perf_counter()
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return (time.perf_counter() - start) * 1000
+
+def round_trips(at):
+    before = len(CLIENT.calls)
+    timed_run(at)
+    return len(CLIENT.calls) - before
+
+def user_id(role, index=0):
+    return [u["id"] for u in CLIENT.tables["users"] if u["role"] == role][index]
+
+def member_flows(count):
+    """
+    `count` members open the planning, go to the last week of the horizon and
+    book a random slot, each step interleaved with the other sessions.
+    """
+    sessions = [session(user_id("user", index)) for index in range(count)]
+    render_ms, booking_ms = [], []
+    for at in random.sample(sessions, len(sessions)):
+        render_ms.append(timed_run(at))
+    for at in random.sample(sessions, len(sessions)):
+        week = at.selectbox(key="user_week")
+        week.select_index(len(week.options) - 1)
+        render_ms.append(timed_run(at))
+    for at in random.sample(sessions, len(sessions)):
+        buttons = [b for b in at.button if b.label in ("Réserver", "Cours complet - Liste d'attente")]
+        if buttons:
+            random.choice(buttons).click()
+            booking_ms.append(timed_run(at))
+    return render_ms, booking_ms
+
+def coach_flows(count):
+    return [timed_run(session(user_id("coach"))) for _ in range(count)]
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0.0
+
+def run_benchmark(members, slots, sessions, latency):
+    global CLIENT
+    CLIENT = seed_club(members, slots, latency)
+    results = {}
+
+    # Round trips, sequentially: the first render fills the shared caches
+    results["member.cold_round_trips"] = round_trips(session(user_id("user", 0)))
+    results["member.warm_round_trips"] = round_trips(session(user_id("user", 1)))
+    results["coach.cold_round_trips"] = round_trips(session(user_id("coach")))
+    results["coach.warm_round_trips"] = round_trips(session(user_id("coach")))
+    results["admin.cold_round_trips"] = round_trips(session(user_id("admin")))
+    results["admin.warm_round_trips"] = round_trips(session(user_id("admin")))
+
+    # Latency, with concurrent sessions
+    render_ms, booking_ms = member_flows(min(sessions, members))
+    coach_ms = coach_flows(max(1, sessions // 10))
+    for name, values in (("member.render", render_ms),
+                         ("member.booking", booking_ms),
+                         ("coach.render", coach_ms)):
+        results[f"{name}_p50_ms"] = round(percentile(values, 50), 1)
+        results[f"{name}_p95_ms"] = round(percentile(values, 95), 1)
+    results["round_trips_total"] = len(CLIENT.calls)
+    return results
+
+if __name__ == "__main__":
+    sys.modules.setdefault("bench", sys.modules["__main__"])
+
+    parser = argparse.ArgumentParser(description="Benchmark des parcours de réservation")
+    parser.add_argument("--members", type=int, default=80)
+    parser.add_argument("--slots", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=80)
+    parser.add_argument("--latency", type=float, default=20, help="latence simulée par requête (ms)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = run_benchmark(args.members, args.slots, args.sessions, args.latency)
+    failures = {k: v for k, v in results.items() if k in THRESHOLDS and v > THRESHOLDS[k]}
+    for name, value in results.items():
+        flag = "  ÉCHEC (max %s)" % THRESHOLDS[name] if name in failures else ""
+        print(f"{name:28s} {value:>10}{flag}")
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps(results, indent=2))
+    sys.exit(1 if failures else 0)
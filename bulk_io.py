@@ -0,0 +1,203 @@
+"""
+CSV import and export of the members and the course schedule.
+
+Imports are done in two steps: plan_*_import() parses the file as a stream,
+validates every row and compares it with the database (a dry run, nothing is
+written), then apply_*_import() writes the creations and modifications by
+chunks of CHUNK_SIZE rows, one request per chunk. Passwords are hashed in
+parallel on the password thread pool.
+"""
+import csv
+import io
+import re
+from passwords import hash_passwords
+
+CHUNK_SIZE = 200
+
+USER_CSV_COLUMNS = ["nom", "email", "password", "role", "formula", "gym_douce_only"]
+COURSE_CSV_COLUMNS = ["id", "title", "weekday", "start_time", "end_time", "capacity"]
+
+ROLES = ["user", "coach", "admin"]
+WEEKDAYS = ["lundi", "mardi", "mercredi", "jeudi", "vendredi"]
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+TIME_RE = re.compile(r"^([01]?\d|2[0-3]):[0-5]\d$")
+
+class ImportPlan:
+    "Result of a dry run: rows to create and to update, and the invalid lines."
+    def __init__(self):
+        self.creates = []
+        self.updates = []
+        self.diff = []     # {"ligne", "clé", "champ", "avant", "après"} of every modified value
+        self.unchanged = 0
+        self.errors = []   # (line, message)
+
+    def add_update(self, line, key, row, existing):
+        changes = _changes(row, existing)
+        if not changes:
+            self.unchanged += 1
+            return
+        self.updates.append(row)
+        for column, value in changes.items():
+            hidden = column == "password"
+            self.diff.append({"ligne": line, "clé": key, "champ": column,
+                              "avant": "" if hidden else existing.get(column),
+                              "après": "(modifié)" if hidden else value})
+
+    @property
+    def is_valid(self):
+        return not self.errors
+
+def read_csv(file):
+    "Yield the rows of a binary or text CSV file one by one, without loading it whole."
+    if not isinstance(file, io.TextIOBase):
+        file = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    for row in csv.DictReader(file, delimiter=";" if _sniff_semicolon(file) else ","):
+        yield {k.strip().lower(): (v or "").strip() for k, v in row.items() if k}
+
+def _sniff_semicolon(file):
+    "Excel in French exports CSV with ';' as separator."
+    position = file.tell()
+    header = file.readline()
+    file.seek(position)
+    return header.count(";") > header.count(",")
+
+def _bool(value):
+    if value.lower() in ("1", "true", "vrai", "oui", "x"):
+        return True
+    if value.lower() in ("", "0", "false", "faux", "non"):
+        return False
+    raise ValueError(f"booléen invalide : {value}")
+
+def _int(value, low, high, label):
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{label} invalide : {value}")
+    if not low <= number <= high:
+        raise ValueError(f"{label} hors limites ({low}-{high}) : {value}")
+    return number
+
+def _changes(new, existing):
+    return {k: v for k, v in new.items() if k != "id" and existing.get(k) != v}
+
+def parse_user(row):
+    "Validated user values of a CSV row; raises ValueError."
+    email = row.get("email", "").lower()
+    if not EMAIL_RE.match(email):
+        raise ValueError(f"email invalide : {email}")
+    if not row.get("nom"):
+        raise ValueError("nom manquant")
+    role = row.get("role") or "user"
+    if role not in ROLES:
+        raise ValueError(f"rôle invalide : {role}")
+    return {
+        "nom": row["nom"],
+        "email": email,
+        "role": role,
+        "formula": _int(row.get("formula") or "1", 1, 5, "formule"),
+        "gym_douce_only": _bool(row.get("gym_douce_only", "")),
+    }
+
+def parse_course(row):
+    "Validated course slot values of a CSV row; raises ValueError."
+    if not row.get("title"):
+        raise ValueError("titre manquant")
+    weekday = row.get("weekday", "").lower()
+    weekday = WEEKDAYS.index(weekday) if weekday in WEEKDAYS else _int(weekday, 0, 4, "jour")
+    for column in ("start_time", "end_time"):
+        if not TIME_RE.match(row.get(column, "")):
+            raise ValueError(f"heure invalide ({column}) : {row.get(column, '')}")
+    course = {
+        "title": row["title"],
+        "weekday": weekday,
+        "start_time": row["start_time"].zfill(5),
+        "end_time": row["end_time"].zfill(5),
+        "capacity": _int(row.get("capacity", ""), 1, 50, "capacité"),
+    }
+    if row.get("id"):
+        course["id"] = _int(row["id"], 1, 2 ** 63 - 1, "id")
+    return course
+
+def plan_users_import(file, existing_users):
+    """
+    Dry run of a members import. Members are matched by email; new ones need
+    a password, existing ones keep theirs unless the column is filled.
+    """
+    plan = ImportPlan()
+    by_email = {u["email"].lower(): u for u in existing_users}
+    seen = set()
+    for line, row in enumerate(read_csv(file), start=2):
+        try:
+            user = parse_user(row)
+        except ValueError as e:
+            plan.errors.append((line, str(e)))
+            continue
+        if user["email"] in seen:
+            plan.errors.append((line, f"email en double dans le fichier : {user['email']}"))
+            continue
+        seen.add(user["email"])
+        existing = by_email.get(user["email"])
+        if existing is None:
+            if not row.get("password"):
+                plan.errors.append((line, "mot de passe manquant pour un nouveau membre"))
+                continue
+            plan.creates.append({**user, "password": row["password"]})
+            continue
+        update = {"id": existing["id"], **user}
+        if row.get("password"):
+            update["password"] = row["password"]
+        plan.add_update(line, user["email"], update, existing)
+    return plan
+
+def plan_courses_import(file, existing_courses):
+    "Dry run of a schedule import. Slots are matched by id; rows without id are created."
+    plan = ImportPlan()
+    by_id = {c["id"]: c for c in existing_courses}
+    for line, row in enumerate(read_csv(file), start=2):
+        try:
+            course = parse_course(row)
+        except ValueError as e:
+            plan.errors.append((line, str(e)))
+            continue
+        if "id" not in course:
+            plan.creates.append(course)
+        elif course["id"] not in by_id:
+            plan.errors.append((line, f"cours introuvable : id {course['id']}"))
+        else:
+            plan.add_update(line, course["id"], course, by_id[course["id"]])
+    return plan
+
+def _chunks(rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        yield rows[start:start + CHUNK_SIZE]
+
+def _with_hashed_passwords(rows):
+    rows = [dict(r) for r in rows]
+    to_hash = [r for r in rows if r.get("password")]
+    for row, hashed in zip(to_hash, hash_passwords([r["password"] for r in to_hash])):
+        row["password"] = hashed
+    return rows
+
+def apply_users_import(repos, plan):
+    "Write a validated members plan; returns the number of written rows."
+    for chunk in _chunks(_with_hashed_passwords(plan.creates)):
+        repos.users.insert(chunk)
+    for chunk in _chunks(_with_hashed_passwords(plan.updates)):
+        repos.users.bulk_update(chunk)
+    return len(plan.creates) + len(plan.updates)
+
+def apply_courses_import(repos, plan):
+    "Write a validated schedule plan; returns the number of written rows."
+    for chunk in _chunks(plan.creates):
+        repos.slots.insert(chunk)
+    for chunk in _chunks(plan.updates):
+        repos.slots.upsert(chunk)
+    return len(plan.creates) + len(plan.updates)
+
+def to_csv(rows, columns):
+    "CSV export of the given columns (other keys, e.g. password hashes, are dropped)."
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
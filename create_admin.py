@@ -1,26 +1,31 @@
-from sqlalchemy.orm import sessionmaker
-from app import engine, Base, User, hash_password
+"""
+Create the first admin account.
 
-# Création de la session
-SessionLocal = sessionmaker(bind=engine)
-db = SessionLocal()
+    SUPABASE_URL=... SUPABASE_KEY=... python create_admin.py [--email admin@example.com]
+"""
+import argparse
+import getpass
+import os
+from supabase import create_client
+from passwords import hash_password
+
+parser = argparse.ArgumentParser(description="Créer le compte administrateur")
+parser.add_argument("--email", default="admin@example.com")
+args = parser.parse_args()
+
+supabase = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"])
 
 # Vérifier si l'admin existe déjà
-admin_email = "admin@example.com"
-admin = db.query(User).filter(User.email == admin_email).first()
+admin = supabase.table("users").select("id").eq("email", args.email).execute().data
 
 if not admin:
-    a = User(
-        email=admin_email,
-        nom="Administrator",
-        password=hash_password("admin1234"),
-        role="admin",
-        formula=5
-    )
-    db.add(a)
-    db.commit()
+    supabase.table("users").insert({
+        "email": args.email,
+        "nom": "Administrator",
+        "password": hash_password(getpass.getpass("Mot de passe admin : ")),
+        "role": "admin",
+        "formula": 5
+    }).execute()
     print("Admin créé !")
 else:
     print("Admin existe déjà")
-
-db.close()
@@ -0,0 +1,373 @@
+"""
+In-memory stand-in for the Supabase client.
+
+Implements the subset of the supabase-py query builder used by
+repositories.py, plus Python versions of the booking RPCs, so the views can
+be run, tested and benchmarked offline:
+
+    from fake_supabase import FakeClient
+    repos = Repositories(FakeClient({"users": [...], "courseslot": [...]}))
+
+Every executed query is recorded in `client.calls` as (table, operation),
+and `latency` (seconds) is slept on each of them to mimic the network.
+"""
+import copy
+import datetime
+import itertools
+import re
+import threading
+import time
+import uuid
+from zoneinfo import ZoneInfo
+from bank_holidays import is_bank_holiday_fr
+
+TABLES = ["users", "courseslot", "reservation", "reservation_event", "closure",
+          "attendance_rollup", "rollover_run", "calendar_version", "notification_outbox"]
+
+# Column holding the id of an embedded resource, e.g. reservation -> users(nom)
+FOREIGN_KEYS = {"users": "user_id", "courseslot": "course_id"}
+
+CLUB_TZ = ZoneInfo("Europe/Paris")
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+def _split_columns(columns):
+    "Split a select() string on top-level commas: 'id, users(nom)' -> ['id', 'users(nom)']"
+    parts, depth, current = [], 0, ""
+    for char in columns:
+        if char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        current += char
+    parts.append(current.strip())
+    return [p for p in parts if p]
+
+def _like(pattern):
+    regex = re.escape(pattern).replace("%", ".*").replace("_", ".")
+    return re.compile(f"^{regex}$", re.IGNORECASE | re.DOTALL)
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.operation = "select"
+        self.columns = "*"
+        self.count_mode = None
+        self.values = None
+        self.filters = []
+        self.orders = []
+        self.bounds = None
+
+    # --- operations ---
+    def select(self, columns="*", count=None):
+        self.operation, self.columns, self.count_mode = "select", columns, count
+        return self
+
+    def insert(self, values):
+        self.operation, self.values = "insert", values
+        return self
+
+    def upsert(self, values, on_conflict=None):
+        self.operation, self.values, self.on_conflict = "upsert", values, on_conflict
+        return self
+
+    def update(self, values):
+        self.operation, self.values = "update", values
+        return self
+
+    def delete(self):
+        self.operation = "delete"
+        return self
+
+    # --- filters ---
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda row: row.get(column) != value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row[column] >= value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row[column] <= value)
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def is_(self, column, value):
+        "Only is_(column, 'null') is supported."
+        self.filters.append(lambda row: row.get(column) is None)
+        return self
+
+    def ilike(self, column, pattern):
+        regex = _like(pattern)
+        self.filters.append(lambda row: row.get(column) is not None and bool(regex.match(str(row[column]))))
+        return self
+
+    def or_(self, filters):
+        "Only 'column.ilike.pattern' terms are supported."
+        terms = []
+        for term in filters.split(","):
+            column, op, pattern = term.split(".", 2)
+            if op != "ilike":
+                raise NotImplementedError(f"or_ operator {op}")
+            terms.append((column, _like(pattern.replace("*", "%"))))
+        self.filters.append(lambda row: any(row.get(c) is not None and regex.match(str(row[c]))
+                                            for c, regex in terms))
+        return self
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, size):
+        self.bounds = (0, size - 1)
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def execute(self):
+        return self.client._execute(self)
+
+class FakeRpc:
+    def __init__(self, client, name, params):
+        self.client, self.name, self.params = client, name, params
+
+    def execute(self):
+        return self.client._execute_rpc(self)
+
+class FakeClient:
+    def __init__(self, tables=None, latency=0.0, now=None):
+        self.tables = {name: [] for name in TABLES}
+        self._ids = {name: itertools.count(1) for name in TABLES}
+        self.latency = latency
+        self.now = now or (lambda: datetime.datetime.now(datetime.timezone.utc))
+        self.calls = []
+        self.functions = {
+            "book_reservation": self._book_reservation,
+            "cancel_reservation": self._cancel_reservation,
+            "bulk_update_users": self._bulk_update_users,
+            "claim_notifications": self._claim_notifications,
+            "complete_notifications": self._complete_notifications,
+            "fail_notification": self._fail_notification,
+        }
+        self._lock = threading.RLock()
+        for name, rows in (tables or {}).items():
+            for row in rows:
+                self._insert_row(name, row)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return FakeRpc(self, name, params or {})
+
+    def reset_calls(self):
+        self.calls = []
+
+    # --- storage ---
+    def _insert_row(self, table, values):
+        row = dict(values)
+        if "id" not in row and table not in ("closure", "attendance_rollup", "calendar_version"):
+            row["id"] = next(self._ids[table])
+        if table == "users":
+            row.setdefault("calendar_token", str(uuid.uuid4()))
+        if table in ("reservation", "notification_outbox"):
+            row.setdefault("created_at", self.now().isoformat())
+            row.setdefault("waitlist", False)
+            row.setdefault("cancelled", False)
+        self.tables.setdefault(table, []).append(row)
+        return row
+
+    def _get(self, table, row_id):
+        return next((r for r in self.tables.get(table, []) if r.get("id") == row_id), None)
+
+    def _project(self, table, row, columns):
+        if columns.strip() == "*":
+            return copy.deepcopy(row)
+        result = {}
+        for column in _split_columns(columns):
+            embedded = re.fullmatch(r"(\w+)\((.*)\)", column)
+            if embedded:
+                other, other_columns = embedded.groups()
+                target = self._get(other, row.get(FOREIGN_KEYS[other]))
+                result[other] = self._project(other, target, other_columns) if target else None
+            else:
+                result[column] = copy.deepcopy(row.get(column))
+        return result
+
+    def _execute(self, query):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls.append((query.table, query.operation))
+            rows = [r for r in self.tables.setdefault(query.table, [])
+                    if all(f(r) for f in query.filters)]
+
+            if query.operation == "insert":
+                values = query.values if isinstance(query.values, list) else [query.values]
+                return FakeResponse([copy.deepcopy(self._insert_row(query.table, v)) for v in values])
+
+            if query.operation == "upsert":
+                values = query.values if isinstance(query.values, list) else [query.values]
+                key = getattr(query, "on_conflict", None) or ("day" if query.table == "closure" else "id")
+                data = []
+                for v in values:
+                    existing = next((r for r in self.tables[query.table]
+                                     if key in v and r.get(key) == v[key]), None)
+                    if existing:
+                        existing.update(v)
+                    else:
+                        existing = self._insert_row(query.table, v)
+                    data.append(copy.deepcopy(existing))
+                return FakeResponse(data)
+
+            if query.operation == "update":
+                for r in rows:
+                    r.update(query.values)
+                return FakeResponse(copy.deepcopy(rows))
+
+            if query.operation == "delete":
+                self.tables[query.table] = [r for r in self.tables[query.table] if r not in rows]
+                return FakeResponse(copy.deepcopy(rows))
+
+            for column, desc in reversed(query.orders):
+                rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+            count = len(rows) if query.count_mode == "exact" else None
+            if query.bounds:
+                rows = rows[query.bounds[0]:query.bounds[1] + 1]
+            return FakeResponse([self._project(query.table, r, query.columns) for r in rows], count)
+
+    def _execute_rpc(self, rpc):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls.append((rpc.name, "rpc"))
+            return FakeResponse(self.functions[rpc.name](**rpc.params))
+
+    # --- RPCs (Python versions of supabase/migrations) ---
+    def _slot_start(self, slot, week_num, year):
+        day = datetime.date.fromisocalendar(year, week_num, slot["weekday"] + 1)
+        start = datetime.time.fromisoformat(slot["start_time"])
+        return datetime.datetime.combine(day, start, tzinfo=CLUB_TZ)
+
+    def _active(self, **conditions):
+        return [r for r in self.tables["reservation"]
+                if not r["cancelled"] and all(r.get(k) == v for k, v in conditions.items())]
+
+    def _book_reservation(self, p_user_id, p_course_id, p_week_num, p_year):
+        user, slot = self._get("users", p_user_id), self._get("courseslot", p_course_id)
+        if not user or not slot:
+            return "not_found"
+        day = datetime.date.fromisocalendar(p_year, p_week_num, slot["weekday"] + 1)
+        if is_bank_holiday_fr(day):
+            return "bank_holiday"
+        if any(c["day"] == day.isoformat() for c in self.tables["closure"]):
+            return "club_closed"
+        if self._slot_start(slot, p_week_num, p_year) < self.now() + datetime.timedelta(hours=2):
+            return "closed"
+        week = {"week_num": p_week_num, "year": p_year}
+        if self._active(user_id=p_user_id, course_id=p_course_id, **week):
+            return "already_booked"
+        if len(self._active(course_id=p_course_id, waitlist=False, **week)) >= slot["capacity"]:
+            self._insert_row("reservation", {"user_id": p_user_id, "course_id": p_course_id,
+                                             "waitlist": True, **week})
+            self._enqueue("waitlisted", p_user_id, p_course_id, p_week_num, p_year)
+            return "waitlist"
+        if len(self._active(user_id=p_user_id, waitlist=False, **week)) >= user["formula"]:
+            return "quota_reached"
+        self._insert_row("reservation", {"user_id": p_user_id, "course_id": p_course_id,
+                                         "waitlist": False, **week})
+        self._enqueue("confirmed", p_user_id, p_course_id, p_week_num, p_year)
+        return "confirmed"
+
+    def _promote_waitlist(self, course_id, week_num, year):
+        slot = self._get("courseslot", course_id)
+        week = {"week_num": week_num, "year": year}
+        free = slot["capacity"] - len(self._active(course_id=course_id, waitlist=False, **week))
+        promoted = 0
+        for r in sorted(self._active(course_id=course_id, waitlist=True, **week),
+                        key=lambda r: (r["created_at"], r["id"])):
+            if free <= 0:
+                break
+            user = self._get("users", r["user_id"])
+            if len(self._active(user_id=r["user_id"], waitlist=False, **week)) >= user["formula"]:
+                continue
+            r["waitlist"] = False
+            self._insert_row("reservation_event", {"reservation_id": r["id"], "kind": "promoted"})
+            self._enqueue("promoted", r["user_id"], course_id, week_num, year)
+            free -= 1
+            promoted += 1
+        return promoted
+
+    def _cancel_reservation(self, p_reservation_id, p_user_id):
+        res = self._get("reservation", p_reservation_id)
+        if not res or res["user_id"] != p_user_id or res["cancelled"]:
+            return "not_found"
+        slot = self._get("courseslot", res["course_id"])
+        if self._slot_start(slot, res["week_num"], res["year"]) < self.now() + datetime.timedelta(hours=2):
+            return "closed"
+        res["cancelled"] = True
+        self._enqueue("cancelled", p_user_id, res["course_id"], res["week_num"], res["year"])
+        if not res["waitlist"]:
+            self._promote_waitlist(res["course_id"], res["week_num"], res["year"])
+        return "cancelled"
+
+    def _bulk_update_users(self, p_rows):
+        updated = 0
+        for row in p_rows:
+            user = self._get("users", row["id"])
+            if user:
+                user.update({k: v for k, v in row.items() if k != "password" or v})
+                updated += 1
+        return updated
+
+    # --- notification outbox (the triggers of the notification_outbox migration) ---
+    def _enqueue(self, kind, user_id, course_id, week_num, year):
+        user, slot = self._get("users", user_id), self._get("courseslot", course_id)
+        day = datetime.date.fromisocalendar(year, week_num, slot["weekday"] + 1)
+        self._insert_row("notification_outbox", {
+            "kind": kind, "user_id": user_id, "attempts": 0,
+            "available_at": self.now().isoformat(), "locked_until": None,
+            "sent_at": None, "failed_at": None, "last_error": None,
+            "payload": {"email": user["email"], "nom": user["nom"], "title": slot["title"],
+                        "day": day.isoformat(), "start_time": slot["start_time"],
+                        "end_time": slot["end_time"], "course_id": course_id,
+                        "week_num": week_num, "year": year}})
+
+    def _claim_notifications(self, p_batch_size, p_lease_seconds):
+        now = self.now().isoformat()
+        pending = [n for n in self.tables["notification_outbox"]
+                   if n["sent_at"] is None and n["failed_at"] is None and n["available_at"] <= now
+                   and (n["locked_until"] is None or n["locked_until"] < now)]
+        batch = sorted(pending, key=lambda n: (n["available_at"], n["id"]))[:p_batch_size]
+        for n in batch:
+            n["locked_until"] = (self.now() + datetime.timedelta(seconds=p_lease_seconds)).isoformat()
+            n["attempts"] += 1
+        return copy.deepcopy(batch)
+
+    def _complete_notifications(self, p_ids):
+        for n in self.tables["notification_outbox"]:
+            if n["id"] in p_ids:
+                n.update(sent_at=self.now().isoformat(), locked_until=None, last_error=None)
+        return len(p_ids)
+
+    def _fail_notification(self, p_id, p_error, p_retry_seconds):
+        n = self._get("notification_outbox", p_id)
+        n.update(last_error=p_error, locked_until=None)
+        if p_retry_seconds is None:
+            n["failed_at"] = self.now().isoformat()
+        else:
+            n["available_at"] = (self.now() + datetime.timedelta(seconds=p_retry_seconds)).isoformat()
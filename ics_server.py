@@ -0,0 +1,259 @@
+"""
+iCalendar subscription feeds of the members and coaches.
+
+    SUPABASE_URL=... SUPABASE_KEY=... python ics_server.py [--port 8502]
+
+- GET /calendar/<token>.ics: the courses booked by a member (waitlisted
+  ones are tentative),
+- GET /calendar/<token>/coach.ics: every course of the planning weeks with
+  its participants, for coaches and admins,
+
+where <token> is the secret users.calendar_token of the member. The feeds
+are built from the reservation and courseslot tables, and cached in memory
+with an ETag made of the versions of the data they depend on (the
+calendar_version table, bumped by triggers on every write, see
+supabase/migrations). A calendar app polling a feed that didn't change gets
+a 304 for the price of one small query; a changed feed is rebuilt, reusing
+the rendered events that didn't change.
+"""
+import argparse
+import datetime
+import http.server
+import os
+import pathlib
+import re
+import threading
+import time
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python 3.10: the toml package, a dependency of Streamlit
+    import toml as tomllib
+from supabase import create_client
+from bank_holidays import closed_days
+from repositories import Repositories
+from schedule import first_open_week, load_slots, planning_week_count, planning_weeks
+
+CLUB_TZ = ZoneInfo("Europe/Paris")
+SECRETS_FILE = pathlib.Path(__file__).parent / ".streamlit" / "secrets.toml"
+
+def read_secrets(path=SECRETS_FILE):
+    "The secrets of the app, for the settings shared with it (empty without the file)."
+    try:
+        return tomllib.loads(path.read_text())
+    except FileNotFoundError:
+        return {}
+
+PLANNING_WEEKS = planning_week_count(read_secrets())
+DOMAIN = "boxe-reventin"
+
+# Users are looked up by token again after this many seconds (role changes, deletions)
+TOKEN_TTL = 300
+# Maximum number of feeds kept in memory
+MAX_FEEDS = 2000
+
+FEED_PATH = re.compile(r"/calendar/([0-9a-fA-F-]{36})(/coach)?\.ics")
+
+# -------------------------
+# iCalendar rendering
+# -------------------------
+def _escape(text):
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def _fold(line):
+    "Split a content line in lines of at most 75 octets (RFC 5545, 3.1)."
+    parts, current, size = [], "", 0
+    for char in line:
+        length = len(char.encode())
+        if size + length > 75:
+            parts.append(current)
+            current, size = " ", 1
+        current += char
+        size += length
+    parts.append(current)
+    return "\r\n".join(parts)
+
+def _utc(day, minutes):
+    local = datetime.datetime.combine(day, datetime.time(minutes // 60, minutes % 60), tzinfo=CLUB_TZ)
+    return local.astimezone(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+@lru_cache(maxsize=8192)
+def render_event(uid, day, start, end, summary, description, status):
+    "One VEVENT; events that didn't change are reused from one build of a feed to the next."
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = ["BEGIN:VEVENT",
+             f"UID:{uid}@{DOMAIN}",
+             f"DTSTAMP:{stamp}",
+             f"DTSTART:{_utc(day, start)}",
+             f"DTEND:{_utc(day, end)}",
+             f"SUMMARY:{_escape(summary)}",
+             f"STATUS:{status}"]
+    if description:
+        lines.append(f"DESCRIPTION:{_escape(description)}")
+    lines.append("END:VEVENT")
+    return "\r\n".join(_fold(line) for line in lines)
+
+def render_calendar(name, events):
+    header = ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:-//{DOMAIN}//inscriptions//FR",
+              "CALSCALE:GREGORIAN", "METHOD:PUBLISH", f"X-WR-CALNAME:{_escape(name)}",
+              "REFRESH-INTERVAL;VALUE=DURATION:PT15M"]
+    return "\r\n".join([*(_fold(line) for line in header), *events, "END:VCALENDAR"]) + "\r\n"
+
+# -------------------------
+# Feeds
+# -------------------------
+class FeedStore:
+    def __init__(self, repos, weeks=PLANNING_WEEKS, today=None):
+        self.repos = repos
+        self.weeks = weeks
+        self.today = today or (lambda: datetime.datetime.now(CLUB_TZ).date())
+        self._lock = threading.Lock()
+        self._users = {}      # token -> (expiry, user)
+        self._schedule = None  # (version, {slot id: Slot}, closures)
+        self._feeds = {}      # member id or "coach" -> (etag, body)
+
+    def user(self, token):
+        "The user of a calendar token, or None."
+        now = time.monotonic()
+        cached = self._users.get(token)
+        if cached and cached[0] > now:
+            return cached[1]
+        user = self.repos.users.by_calendar_token(token.lower())
+        with self._lock:
+            if len(self._users) >= MAX_FEEDS:
+                self._users.clear()
+            self._users[token] = (now + TOKEN_TTL, user)
+        return user
+
+    def etag(self, user, coach):
+        "ETag of the current content of a feed, and the versions it is made of."
+        feeds = ["schedule", "roster" if coach else f"user:{user['id']}"]
+        versions = self.repos.reservations.calendar_versions(feeds)
+        week_num, year = first_open_week(self.today())
+        tag = "-".join(str(versions.get(feed, 0)) for feed in feeds)
+        key = "coach" if coach else f"m{user['id']}"
+        return f'"{key}-{tag}-{year}w{week_num}"', versions
+
+    def feed(self, user, coach, etag, versions):
+        key = "coach" if coach else user["id"]
+        cached = self._feeds.get(key)
+        if cached and cached[0] == etag:
+            return cached[1]
+        slots, closures = self._load_schedule(versions.get("schedule", 0))
+        if coach:
+            body = self._coach_feed(slots, closures)
+        else:
+            body = self._member_feed(user, slots)
+        with self._lock:
+            if len(self._feeds) >= MAX_FEEDS:
+                self._feeds.pop(next(iter(self._feeds)))
+            self._feeds[key] = (etag, body)
+        return body
+
+    def _load_schedule(self, version):
+        "Slots and closures, fetched again only when the 'schedule' version changes."
+        schedule = self._schedule
+        if schedule is None or schedule[0] != version:
+            rows, closures = self.repos.gather(self.repos.slots.list_all, self.repos.slots.closures)
+            schedule = (version, {slot.id: slot for slot in load_slots(rows)},
+                        frozenset(datetime.date.fromisoformat(c["day"]) for c in closures))
+            self._schedule = schedule
+        return schedule[1], schedule[2]
+
+    def _member_feed(self, user, slots):
+        # The user of the token cache may predate a rename, which bumped 'user:<id>'
+        current, reservations = self.repos.gather(lambda: self.repos.users.by_id(user["id"]),
+                                                  lambda: self.repos.reservations.active_for_user(user["id"]))
+        user = current or user
+        events = []
+        for r in reservations:
+            slot = slots.get(r["course_id"])
+            if slot is None:
+                continue
+            day = datetime.date.fromisocalendar(r["year"], r["week_num"], slot.weekday + 1)
+            summary = slot.title + (" (liste d'attente)" if r["waitlist"] else "")
+            events.append((day, slot.start, render_event(
+                f"reservation-{r['id']}", day, slot.start, slot.end, summary, "",
+                "TENTATIVE" if r["waitlist"] else "CONFIRMED")))
+        return render_calendar(f"Boxe Reventin - {user['nom']}", [e for *_, e in sorted(events)])
+
+    def _coach_feed(self, slots, closures):
+        weeks = planning_weeks(self.today(), self.weeks)
+        rosters = self.repos.gather(*(lambda w=w: self.repos.reservations.roster_for_week(*w) for w in weeks))
+        events = []
+        for (week_num, year), rows in zip(weeks, rosters):
+            closed = closed_days(week_num, year, closures)
+            roster = {}
+            for r in rows:
+                entry = roster.setdefault(r["course_id"], {"confirmed": [], "waitlist": []})
+                nom = r["users"]["nom"] if r.get("users") else "Inconnu"
+                entry["waitlist" if r["waitlist"] else "confirmed"].append(nom)
+            for slot in slots.values():
+                day = datetime.date.fromisocalendar(year, week_num, slot.weekday + 1)
+                if day in closed:
+                    continue
+                participants = roster.get(slot.id, {"confirmed": [], "waitlist": []})
+                names = participants["confirmed"] + [f"{nom} (liste d'attente)" for nom in participants["waitlist"]]
+                events.append((day, slot.start, render_event(
+                    f"cours-{slot.id}-{year}-{week_num}", day, slot.start, slot.end,
+                    f"{slot.title} ({len(participants['confirmed'])}/{slot.capacity})",
+                    "\n".join(names), "CONFIRMED")))
+        return render_calendar("Boxe Reventin - Planning coach", [e for *_, e in sorted(events)])
+
+# -------------------------
+# HTTP
+# -------------------------
+class FeedHandler(http.server.BaseHTTPRequestHandler):
+    server_version = "ics_server"
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        match = FEED_PATH.fullmatch(self.path.split("?", 1)[0])
+        store = self.server.store
+        user = store.user(match.group(1)) if match else None
+        coach = bool(match and match.group(2))
+        if user is None or (coach and user["role"] not in ("coach", "admin")):
+            self.send_error(404)
+            return
+        etag, versions = store.etag(user, coach)
+        if etag in [tag.strip().removeprefix("W/") for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = store.feed(user, coach, etag, versions).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/calendar; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "private, no-cache")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # The path holds the secret token of the member
+        super().log_message(format, *(FEED_PATH.sub("/calendar/…", arg) if isinstance(arg, str) else arg
+                                      for arg in args))
+
+def make_server(repos, host="", port=8502):
+    server = http.server.ThreadingHTTPServer((host, port), FeedHandler)
+    server.store = FeedStore(repos)
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args()
+
+    repos = Repositories(create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"]))
+    server = make_server(repos, args.host, args.port)
+    print(f"Flux agenda sur le port {server.server_address[1]}")
+    server.serve_forever()
@@ -0,0 +1,153 @@
+"""
+Instrumentation of the Supabase client.
+
+InstrumentedClient wraps a client (supabase-py or fake_supabase.FakeClient)
+and reports every executed query to a QueryRecorder: table (or RPC name),
+operation, filter shape, row count, response size and wall time, tagged with
+the context returned by the recorder's `context` callable (the app adds the
+Streamlit session, rerun and view).
+
+Filter values are never recorded, only the columns and operators, e.g.
+"eq(user_id) eq(week_num)", so the log holds no personal data and queries of
+the same shape are aggregated together.
+
+Every query is also logged as a JSON line on the "supabase.queries" logger
+(DEBUG, or WARNING above SLOW_QUERY_MS).
+"""
+import collections
+import json
+import logging
+import threading
+import time
+
+SLOW_QUERY_MS = 200
+
+# Upper bounds (ms) of the duration histogram buckets; the last one is open
+HISTOGRAM_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000]
+
+# Query builder methods recorded as the filter shape of a query
+FILTER_METHODS = {"eq", "neq", "gt", "gte", "lt", "lte", "like", "ilike", "in_", "is_",
+                  "or_", "order", "limit", "range"}
+
+OPERATIONS = {"select", "insert", "upsert", "update", "delete"}
+
+logger = logging.getLogger("supabase.queries")
+
+class QueryRecorder:
+    def __init__(self, context=None, max_events=5000):
+        self.context = context or (lambda: {})
+        self.events = collections.deque(maxlen=max_events)
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, table, operation, filters, data, ms, error=None):
+        rows = len(data) if isinstance(data, list) else int(data is not None)
+        event = {
+            "ts": time.time(),
+            **self.context(),
+            "table": table,
+            "operation": operation,
+            "filters": " ".join(filters),
+            "rows": rows,
+            "bytes": len(json.dumps(data, default=str)) if data is not None else 0,
+            "ms": round(ms, 2),
+            "error": error,
+        }
+        key = (table, operation, event["filters"])
+        with self._lock:
+            self.events.append(event)
+            stats = self.stats.setdefault(key, {"count": 0, "errors": 0, "ms": 0.0, "max_ms": 0.0,
+                                                "rows": 0, "bytes": 0,
+                                                "histogram": [0] * (len(HISTOGRAM_BUCKETS) + 1)})
+            stats["count"] += 1
+            stats["errors"] += error is not None
+            stats["ms"] += ms
+            stats["max_ms"] = max(stats["max_ms"], ms)
+            stats["rows"] += rows
+            stats["bytes"] += event["bytes"]
+            stats["histogram"][next((i for i, bound in enumerate(HISTOGRAM_BUCKETS) if ms <= bound),
+                                    len(HISTOGRAM_BUCKETS))] += 1
+        logger.log(logging.WARNING if ms > SLOW_QUERY_MS else logging.DEBUG, json.dumps(event, default=str))
+
+    def summary(self):
+        "One row per query shape, slowest total time first."
+        with self._lock:
+            rows = [{"table": table, "operation": operation, "filters": filters,
+                     "count": s["count"], "errors": s["errors"],
+                     "total_ms": round(s["ms"], 1), "mean_ms": round(s["ms"] / s["count"], 1),
+                     "max_ms": round(s["max_ms"], 1), "rows": s["rows"], "bytes": s["bytes"]}
+                    for (table, operation, filters), s in self.stats.items()]
+        return sorted(rows, key=lambda r: r["total_ms"], reverse=True)
+
+    def histogram(self):
+        "Number of queries per duration bucket, over all query shapes."
+        labels = [f"≤ {bound} ms" for bound in HISTOGRAM_BUCKETS] + [f"> {HISTOGRAM_BUCKETS[-1]} ms"]
+        with self._lock:
+            counts = [sum(s["histogram"][i] for s in self.stats.values()) for i in range(len(labels))]
+        return dict(zip(labels, counts))
+
+    def recent_events(self):
+        with self._lock:
+            return list(self.events)
+
+    def export(self):
+        "JSON export of the aggregated stats and the recent queries."
+        return json.dumps({"summary": self.summary(), "histogram": self.histogram(),
+                           "events": self.recent_events()}, default=str, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self.events.clear()
+            self.stats.clear()
+
+class _InstrumentedQuery:
+    "Proxy of a query builder recording the filter shape until execute()."
+    def __init__(self, recorder, builder, table, operation="select", filters=()):
+        self._recorder = recorder
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+        self._filters = list(filters)
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr) or name == "execute":
+            return attr
+
+        def method(*args, **kwargs):
+            operation, filters = self._operation, self._filters
+            if name in OPERATIONS:
+                operation = name
+            elif name in FILTER_METHODS:
+                column = args[0] if name not in ("or_", "limit", "range") else ""
+                filters = filters + [f"{name.rstrip('_')}({column})"]
+            return _InstrumentedQuery(self._recorder, attr(*args, **kwargs), self._table, operation, filters)
+        return method
+
+    def execute(self):
+        start = time.perf_counter()
+        try:
+            response = self._builder.execute()
+        except Exception as e:
+            self._recorder.record(self._table, self._operation, self._filters, None,
+                                  (time.perf_counter() - start) * 1000, error=repr(e))
+            raise
+        self._recorder.record(self._table, self._operation, self._filters, response.data,
+                              (time.perf_counter() - start) * 1000)
+        return response
+
+class InstrumentedClient:
+    def __init__(self, client, recorder):
+        self.client = client
+        self.recorder = recorder
+
+    def table(self, name):
+        return _InstrumentedQuery(self.recorder, self.client.table(name), name)
+
+    def rpc(self, name, params=None):
+        params = params or {}
+        return _InstrumentedQuery(self.recorder, self.client.rpc(name, params), name, "rpc",
+                                  [f"param({p})" for p in params])
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,168 @@
+"""
+Email notifications: messages and transports.
+
+render_email() turns a row of the notification outbox (see the
+notification_outbox migration) into an email. A transport sends emails over
+one connection per batch:
+
+    with transport:
+        transport.send(message)   # raises on failure
+
+- SmtpTransport: a real SMTP server (SMTP_HOST, SMTP_PORT, ...),
+- MemoryTransport: keeps the messages in a list, for offline runs,
+- LocalSmtpServer: a minimal SMTP server on localhost which stores what it
+  receives, to check SmtpTransport end to end without sending anything.
+"""
+import datetime
+import email
+import email.message
+import email.policy
+import os
+import smtplib
+import socketserver
+import threading
+
+MONTHS = ["janvier", "février", "mars", "avril", "mai", "juin", "juillet", "août",
+          "septembre", "octobre", "novembre", "décembre"]
+WEEKDAYS = ["lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"]
+
+# kind -> (subject, first line of the body)
+TEMPLATES = {
+    "confirmed": ("Réservation confirmée : {course}",
+                  "Votre réservation pour le cours {course} est confirmée."),
+    "waitlisted": ("Liste d'attente : {course}",
+                   "Le cours {course} est complet : vous êtes sur liste d'attente. "
+                   "Vous recevrez un email si une place se libère."),
+    "promoted": ("Une place s'est libérée : {course}",
+                 "Une place s'est libérée : votre réservation pour le cours {course} est confirmée."),
+    "cancelled": ("Réservation annulée : {course}",
+                  "Votre réservation pour le cours {course} est annulée."),
+    "course_cancelled": ("Cours annulé : {course}",
+                         "Le cours {course} est annulé par le club. Votre réservation est supprimée."),
+    "club_closed": ("Club fermé : {course}",
+                    "Le club sera fermé ce jour-là : le cours {course} n'aura pas lieu."),
+}
+
+def format_day(day):
+    day = datetime.date.fromisoformat(day)
+    return f"{WEEKDAYS[day.weekday()]} {day.day} {MONTHS[day.month - 1]}"
+
+def render_email(notification, sender):
+    payload = notification["payload"]
+    course = (f"{payload['title']} du {format_day(payload['day'])} "
+              f"({str(payload['start_time'])[:5]}-{str(payload['end_time'])[:5]})")
+    subject, text = TEMPLATES[notification["kind"]]
+    message = email.message.EmailMessage()
+    message["From"] = sender
+    message["To"] = payload["email"]
+    message["Subject"] = subject.format(course=course)
+    message.set_content(f"Bonjour {payload['nom']},\n\n{text.format(course=course)}\n\n"
+                        "Club de Boxe Reventin\n")
+    return message
+
+class SmtpTransport:
+    def __init__(self, host, port=587, username=None, password=None, starttls=True, timeout=30):
+        self.host, self.port = host, port
+        self.username, self.password = username, password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._smtp = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ["SMTP_HOST"], int(os.environ.get("SMTP_PORT", 587)),
+                   os.environ.get("SMTP_USER"), os.environ.get("SMTP_PASSWORD"),
+                   starttls=os.environ.get("SMTP_STARTTLS", "1") != "0")
+
+    def __enter__(self):
+        self._smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            self._smtp.starttls()
+        if self.username:
+            self._smtp.login(self.username, self.password)
+        return self
+
+    def send(self, message):
+        self._smtp.send_message(message)
+
+    def __exit__(self, *exc_info):
+        try:
+            self._smtp.quit()
+        except smtplib.SMTPException:
+            pass
+        self._smtp = None
+
+class MemoryTransport:
+    def __init__(self, reject=()):
+        self.messages = []
+        self.reject = set(reject)  # recipients refused, to exercise the retries
+
+    def __enter__(self):
+        return self
+
+    def send(self, message):
+        if message["To"] in self.reject:
+            raise smtplib.SMTPRecipientsRefused({message["To"]: (550, b"rejected")})
+        self.messages.append(message)
+
+    def __exit__(self, *exc_info):
+        pass
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    "The few SMTP commands smtplib sends without TLS nor authentication."
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 localhost SMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb, _, argument = line.decode().strip().partition(" ")
+            verb = verb.upper()
+            if verb in ("HELO", "EHLO"):
+                self.reply("250 localhost")
+            elif verb == "RCPT":
+                address = argument.partition(":")[2].strip().strip("<>")
+                self.reply("550 Mailbox unavailable" if address in self.server.reject else "250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for data in iter(self.rfile.readline, b""):
+                    if data == b".\r\n":
+                        break
+                    lines.append(data[1:] if data.startswith(b"..") else data)
+                message = email.message_from_bytes(b"".join(lines), policy=email.policy.default)
+                with self.server.lock:
+                    self.server.messages.append(message)
+                self.reply("250 OK")
+            elif verb in ("MAIL", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class LocalSmtpServer(socketserver.ThreadingTCPServer):
+    """
+    SMTP stand-in on localhost; received emails are in `messages`. Use it
+    with SmtpTransport("127.0.0.1", server.port, starttls=False).
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, reject=()):
+        super().__init__(("127.0.0.1", port), _SmtpHandler)
+        self.messages = []
+        self.reject = set(reject)
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -0,0 +1,163 @@
+"""
+Notification outbox worker.
+
+Drains the notification_outbox table (filled by database triggers in the
+transaction of each booking, cancellation and waitlist promotion) outside of
+the app: notifications are claimed by batches under a lease, sent over one
+transport connection per batch, then marked as sent. A failed notification
+is retried with exponential backoff, and given up after MAX_ATTEMPTS. Several
+workers can run at once; a crashed worker's batch is claimed again when its
+lease expires.
+
+Throughput (emails/s), batch latency and queue lag are logged every
+--report-seconds on the "notifications.outbox" logger.
+
+    SUPABASE_URL=... SUPABASE_KEY=... SMTP_HOST=... SMTP_FROM=... python outbox_worker.py
+    python outbox_worker.py --once --transport local   # local SMTP stand-in, prints the emails
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import time
+from supabase import create_client
+from notifications import LocalSmtpServer, SmtpTransport, render_email
+from repositories import Repositories
+
+BATCH_SIZE = 50
+LEASE_SECONDS = 300
+POLL_SECONDS = 5
+MAX_ATTEMPTS = 6
+BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 3600
+
+logger = logging.getLogger("notifications.outbox")
+
+def retry_delay(attempts):
+    "Seconds before the next attempt, or None to give up."
+    if attempts >= MAX_ATTEMPTS:
+        return None
+    delay = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** (attempts - 1))
+    return int(delay * random.uniform(0.8, 1.2))
+
+class WorkerMetrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.batches = 0
+        self.sent = 0
+        self.retried = 0
+        self.given_up = 0
+        self.batch_seconds = 0.0
+        self.max_lag_seconds = 0.0
+
+    def record_batch(self, sent, retried, given_up, seconds, lag_seconds):
+        self.batches += 1
+        self.sent += sent
+        self.retried += retried
+        self.given_up += given_up
+        self.batch_seconds += seconds
+        self.max_lag_seconds = max(self.max_lag_seconds, lag_seconds)
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "batches": self.batches,
+            "sent": self.sent,
+            "retried": self.retried,
+            "given_up": self.given_up,
+            "emails_per_second": round(self.sent / elapsed, 2) if elapsed else 0.0,
+            "mean_batch_ms": round(self.batch_seconds / self.batches * 1000, 1) if self.batches else 0.0,
+            "max_lag_seconds": round(self.max_lag_seconds, 1),
+        }
+
+def _lag_seconds(notifications):
+    "Age of the oldest notification of a batch."
+    oldest = min(datetime.datetime.fromisoformat(n["created_at"]) for n in notifications)
+    return (datetime.datetime.now(datetime.timezone.utc) - oldest).total_seconds()
+
+class OutboxWorker:
+    def __init__(self, repos, transport, sender, batch_size=BATCH_SIZE, lease_seconds=LEASE_SECONDS):
+        self.repos = repos
+        self.transport = transport
+        self.sender = sender
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.metrics = WorkerMetrics()
+
+    def drain_batch(self):
+        "Send one batch; returns the number of claimed notifications."
+        batch = self.repos.notifications.claim(self.batch_size, self.lease_seconds)
+        if not batch:
+            return 0
+        start = time.monotonic()
+        sent, errors = [], {}
+        try:
+            with self.transport:
+                for notification in batch:
+                    try:
+                        self.transport.send(render_email(notification, self.sender))
+                        sent.append(notification["id"])
+                    except Exception as e:
+                        errors[notification["id"]] = repr(e)
+        except Exception as e:
+            # Connection failure: every notification not sent yet is retried
+            for notification in batch:
+                if notification["id"] not in sent:
+                    errors.setdefault(notification["id"], repr(e))
+
+        if sent:
+            self.repos.notifications.complete(sent)
+        given_up = 0
+        for notification in batch:
+            if notification["id"] in errors:
+                delay = retry_delay(notification["attempts"])
+                given_up += delay is None
+                self.repos.notifications.fail(notification["id"], errors[notification["id"]], delay)
+                logger.warning("notification %s (%s) failed, attempt %s: %s", notification["id"],
+                               notification["kind"], notification["attempts"], errors[notification["id"]])
+        self.metrics.record_batch(len(sent), len(errors) - given_up, given_up,
+                                  time.monotonic() - start, _lag_seconds(batch))
+        return len(batch)
+
+    def run(self, once=False, poll_seconds=POLL_SECONDS, report_seconds=60):
+        "Drain the outbox; with `once`, stop when it is empty."
+        next_report = time.monotonic() + report_seconds
+        try:
+            while True:
+                claimed = self.drain_batch()
+                if time.monotonic() >= next_report:
+                    logger.info(json.dumps(self.metrics.summary()))
+                    next_report = time.monotonic() + report_seconds
+                if claimed < self.batch_size:
+                    if once:
+                        return self.metrics.summary()
+                    time.sleep(poll_seconds)
+        except KeyboardInterrupt:
+            return self.metrics.summary()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--once", action="store_true", help="stop when the outbox is empty")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--transport", choices=["smtp", "local"], default="smtp",
+                        help="local: SMTP stand-in on localhost, nothing is really sent")
+    parser.add_argument("--report-seconds", type=float, default=60)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    local_server = None
+    if args.transport == "local":
+        local_server = LocalSmtpServer().start()
+        transport = SmtpTransport("127.0.0.1", local_server.port, starttls=False)
+    else:
+        transport = SmtpTransport.from_env()
+    repos = Repositories(create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"]))
+    worker = OutboxWorker(repos, transport, os.environ.get("SMTP_FROM", "club@boxe-reventin.fr"),
+                          batch_size=args.batch_size)
+    summary = worker.run(once=args.once, report_seconds=args.report_seconds)
+    if local_server:
+        for message in local_server.messages:
+            print(f"{message['To']:30s} {message['Subject']}")
+    print(json.dumps(summary))
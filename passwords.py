@@ -0,0 +1,92 @@
+"""
+Password hashing.
+
+Passwords are hashed with bcrypt, whose cost is set by BCRYPT_ROUNDS (env
+variable, 12 by default). Legacy unsalted SHA-256 hashes are still accepted
+and, like bcrypt hashes with a lower cost, are replaced on the next
+successful login (see verify_and_update).
+
+bcrypt releases the GIL, so a login hashing on its session's script thread
+doesn't stall the other Streamlit sessions. Bulk hashing (hash_passwords, for
+CSV imports) runs on a small thread pool, whose size bounds the CPU spent on
+it.
+
+Run `python passwords.py --target-ms 250` to pick the highest cost meeting a
+login latency target on the current machine.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt", "hex_sha256"],
+    deprecated=["hex_sha256"],
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="passwords")
+
+def hash_password(pw):
+    return pwd_context.hash(pw)
+
+def hash_passwords(passwords):
+    "Hash several passwords in parallel, preserving order."
+    return list(_executor.map(pwd_context.hash, passwords))
+
+def verify_and_update(pw, hashed):
+    """
+    Return (valid, new_hash). new_hash is set when the password is valid but
+    its stored hash is legacy or weaker than BCRYPT_ROUNDS and must be replaced.
+    A stored value that isn't a known hash (e.g. a '-' placeholder) is invalid.
+    """
+    if not hashed:
+        return False, None
+    try:
+        return pwd_context.verify_and_update(pw, hashed)
+    except ValueError:  # passlib.exc.UnknownHashError, malformed hash
+        return False, None
+
+def verify_password(pw, hashed):
+    return verify_and_update(pw, hashed)[0]
+
+# -------------------------
+# Benchmark
+# -------------------------
+def time_rounds(rounds, samples=3):
+    "Median time in ms of a bcrypt hash + verify with the given cost."
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.verify("benchmark", context.hash("benchmark"))
+        timings.append((time.perf_counter() - start) * 1000 / 2)
+    return sorted(timings)[len(timings) // 2]
+
+def calibrate_rounds(target_ms, min_rounds=10, max_rounds=16):
+    """
+    Highest bcrypt cost whose verification stays under target_ms, along with
+    the measured {rounds: ms}.
+    """
+    timings = {}
+    best = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        timings[rounds] = time_rounds(rounds)
+        if timings[rounds] > target_ms:
+            break
+        best = rounds
+    return best, timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Choose the bcrypt cost for a login latency target")
+    parser.add_argument("--target-ms", type=float, default=250)
+    args = parser.parse_args()
+
+    best, timings = calibrate_rounds(args.target_ms)
+    for rounds, ms in timings.items():
+        print(f"rounds={rounds:2d}  {ms:8.1f} ms")
+    print(f"BCRYPT_ROUNDS={best}")
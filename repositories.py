@@ -0,0 +1,202 @@
+"""
+Data access layer.
+
+The views don't build Supabase queries themselves: they go through the
+repositories below, which share one client, and therefore one pooled HTTP
+connection, per process. Repositories.gather() runs independent reads
+concurrently on a small thread pool.
+
+Any object with the supabase-py query builder interface can be used as the
+client, e.g. fake_supabase.FakeClient to run the views offline.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+# Columns of a user that are safe to keep in memory (never the password hash)
+USER_COLUMNS = ["id", "nom", "email", "role", "formula", "gym_douce_only"]
+
+class UserRepo:
+    def __init__(self, client):
+        self.client = client
+
+    def by_email(self, email):
+        "The full user row, password hash included (for login only)."
+        data = self.client.table("users").select("*").eq("email", email).execute().data
+        return data[0] if data else None
+
+    def by_calendar_token(self, token):
+        data = self.client.table("users").select(", ".join(USER_COLUMNS)).eq("calendar_token", token).execute().data
+        return data[0] if data else None
+
+    def calendar_token(self, user_id):
+        data = self.client.table("users").select("calendar_token").eq("id", user_id).execute().data
+        return data[0]["calendar_token"] if data else None
+
+    def by_id(self, user_id):
+        data = self.client.table("users").select(", ".join(USER_COLUMNS)).eq("id", user_id).execute().data
+        return data[0] if data else None
+
+    def iter_all(self, page_size=1000):
+        "All users, ordered by id, fetched page by page."
+        offset = 0
+        while True:
+            page = self.client.table("users").select(", ".join(USER_COLUMNS)) \
+                .order("id").range(offset, offset + page_size - 1).execute().data
+            yield from page
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    def search(self, text="", role=None, offset=0, limit=50):
+        """
+        One page of users, ordered by name, whose name or email contains
+        `text` (case-insensitive), optionally of a single role.
+        Return (rows, total number of matching users).
+        """
+        query = self.client.table("users").select(", ".join(USER_COLUMNS), count="exact")
+        if text:
+            # Characters with a meaning in PostgREST's or=(...) syntax
+            pattern = "".join(c for c in text if c not in ',()*"\\')
+            query = query.or_(f"nom.ilike.*{pattern}*,email.ilike.*{pattern}*")
+        if role:
+            query = query.eq("role", role)
+        response = query.order("nom").order("id").range(offset, offset + limit - 1).execute()
+        return response.data, response.count or 0
+
+    def insert(self, values):
+        "Insert one user, or a list of users in a single request."
+        return self.client.table("users").insert(values).execute().data
+
+    def update(self, user_id, values):
+        return self.client.table("users").update(values).eq("id", user_id).execute().data
+
+    def bulk_update(self, rows):
+        "Update a list of users in a single request (see the bulk_update_users RPC)."
+        return self.client.rpc("bulk_update_users", {"p_rows": rows}).execute().data
+
+    def delete(self, user_id):
+        return self.client.table("users").delete().eq("id", user_id).execute().data
+
+class SlotRepo:
+    def __init__(self, client):
+        self.client = client
+
+    def list_all(self):
+        "All course slots, ordered by weekday and start time."
+        return self.client.table("courseslot").select("*").order("weekday").order("start_time").execute().data
+
+    def insert(self, values):
+        "Insert one slot, or a list of slots in a single request."
+        return self.client.table("courseslot").insert(values).execute().data
+
+    def upsert(self, rows):
+        "Update (or create) complete slot rows, matched by id, in a single request."
+        return self.client.table("courseslot").upsert(rows).execute().data
+
+    def update(self, course_id, values):
+        return self.client.table("courseslot").update(values).eq("id", course_id).execute().data
+
+    def delete(self, course_id):
+        return self.client.table("courseslot").delete().eq("id", course_id).execute().data
+
+    def closures(self):
+        return self.client.table("closure").select("day, reason").order("day").execute().data
+
+    def add_closure(self, day, reason):
+        return self.client.table("closure").upsert({"day": day.isoformat(), "reason": reason}).execute().data
+
+    def delete_closure(self, day):
+        return self.client.table("closure").delete().eq("day", day.isoformat()).execute().data
+
+class ReservationRepo:
+    def __init__(self, client):
+        self.client = client
+
+    def active_for_week(self, week_num, year):
+        "Active (not cancelled) reservations of a week, confirmed and waitlisted."
+        return self.client.table("reservation").select("id, course_id, user_id, waitlist") \
+            .eq("cancelled", False).eq("week_num", week_num).eq("year", year).execute().data
+
+    def active_for_user(self, user_id):
+        "Active reservations of a user, of every week not archived yet."
+        return self.client.table("reservation").select("id, course_id, week_num, year, waitlist") \
+            .eq("user_id", user_id).eq("cancelled", False).execute().data
+
+    def active_id(self, user_id, course_id, week_num, year):
+        "Id of the active reservation of a user for a slot and week, or None."
+        data = self.client.table("reservation").select("id") \
+            .eq("user_id", user_id).eq("course_id", course_id).eq("cancelled", False) \
+            .eq("week_num", week_num).eq("year", year).execute().data
+        return data[0]["id"] if data else None
+
+    def roster_for_week(self, week_num, year):
+        "Active reservations of a week with the user's name, in booking order."
+        return self.client.table("reservation").select("course_id, waitlist, users(nom)") \
+            .eq("cancelled", False).eq("week_num", week_num).eq("year", year) \
+            .order("created_at").order("id").execute().data
+
+    def book(self, user_id, course_id, week_num, year):
+        "Status returned by the book_reservation RPC (see supabase/migrations)."
+        return self.client.rpc("book_reservation", {
+            "p_user_id": user_id,
+            "p_course_id": course_id,
+            "p_week_num": week_num,
+            "p_year": year
+        }).execute().data
+
+    def cancel(self, reservation_id, user_id):
+        "Status returned by the cancel_reservation RPC (see supabase/migrations)."
+        return self.client.rpc("cancel_reservation", {
+            "p_reservation_id": reservation_id,
+            "p_user_id": user_id
+        }).execute().data
+
+    def attendance_rollup(self, first_year, last_year, columns):
+        return self.client.table("attendance_rollup").select(",".join(columns)) \
+            .gte("year", first_year).lte("year", last_year).execute().data
+
+    def calendar_versions(self, feeds):
+        "{feed: version} of the given calendar feeds (see the calendar_feeds migration)."
+        data = self.client.table("calendar_version").select("feed, version").in_("feed", feeds).execute().data
+        return {row["feed"]: row["version"] for row in data}
+
+    def rollover_runs(self, limit=10):
+        return self.client.table("rollover_run").select("*").order("id", desc=True).limit(limit).execute().data
+
+class NotificationRepo:
+    "Outbox of the email notifications (see the notification_outbox migration)."
+    def __init__(self, client):
+        self.client = client
+
+    def claim(self, batch_size, lease_seconds):
+        return self.client.rpc("claim_notifications", {
+            "p_batch_size": batch_size,
+            "p_lease_seconds": lease_seconds
+        }).execute().data
+
+    def complete(self, ids):
+        return self.client.rpc("complete_notifications", {"p_ids": ids}).execute().data
+
+    def fail(self, notification_id, error, retry_seconds):
+        return self.client.rpc("fail_notification", {
+            "p_id": notification_id,
+            "p_error": error,
+            "p_retry_seconds": retry_seconds
+        }).execute().data
+
+    def pending_count(self):
+        return self.client.table("notification_outbox").select("id", count="exact") \
+            .is_("sent_at", "null").is_("failed_at", "null").limit(1).execute().count
+
+class Repositories:
+    def __init__(self, client, max_workers=8):
+        self.client = client
+        self.users = UserRepo(client)
+        self.slots = SlotRepo(client)
+        self.reservations = ReservationRepo(client)
+        self.notifications = NotificationRepo(client)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="repositories")
+
+    def gather(self, *calls):
+        "Run independent zero-argument calls concurrently, and return their results in order."
+        futures = [self._executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
@@ -0,0 +1,34 @@
+"""
+Weekly rollover: move the reservations of finished weeks to the archive.
+
+Safe to run at any time and as often as needed: a run that was interrupted
+is resumed, and once everything is archived it does nothing.
+
+    SUPABASE_URL=... SUPABASE_KEY=... python rollover.py [--batch-size 1000]
+"""
+import argparse
+import datetime
+import os
+from supabase import create_client
+from schedule import first_open_week
+
+def run_rollover(client, week_num, year, batch_size):
+    run_id = client.rpc("start_rollover", {"p_week_num": week_num, "p_year": year}).execute().data
+    while True:
+        moved = client.rpc("rollover_batch", {"p_run_id": run_id, "p_batch_size": batch_size}).execute().data
+        if not moved:
+            break
+        print(f"run {run_id}: {moved} réservations archivées")
+    client.rpc("finish_rollover", {"p_run_id": run_id}).execute()
+    return client.table("rollover_run").select("*").eq("id", run_id).execute().data[0]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    client = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"])
+    week_num, year = first_open_week(datetime.date.today())
+    run = run_rollover(client, week_num, year, args.batch_size)
+    print(f"Rollover avant la semaine {week_num}/{year} : {run['moved']} réservations "
+          f"archivées en {run['batches']} lots")
@@ -0,0 +1,133 @@
+"""
+Course slot model and booking eligibility.
+
+Course slots are parsed once, when loaded, into compact Slot objects whose
+start and end times are minutes since midnight. week_eligibility() then
+checks every slot of a week in a single pass: the days (bank holidays, club
+closures) are checked once each, and the 2-hour rule is an integer
+comparison per slot against the current time expressed in minutes since the
+start of the week.
+
+Times are wall-clock times of the club's timezone: `now` must be given in
+that timezone. Daylight saving time changes happen on a Sunday night, so
+they never fall between a weekday course and a time less than 2 hours
+before it.
+
+The planning horizon (planning_weeks) is shared by the app and the calendar
+feeds (ics_server.py), from the same [planning] weeks setting.
+"""
+import datetime
+from bank_holidays import is_bank_holiday_fr, week_dates
+
+# Bookings and cancellations close this many minutes before the course
+BOOKING_DELAY = 120
+
+MINUTES_PER_DAY = 24 * 60
+
+def parse_time(value):
+    "Minutes since midnight of a 'HH:MM' (or 'HH:MM:SS') time."
+    hours, _, rest = value.partition(":")
+    return int(hours) * 60 + int(rest[:2] or 0)
+
+def format_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+class Slot:
+    "A weekly course slot, parsed from a courseslot row."
+    __slots__ = ("id", "title", "weekday", "start", "end", "capacity", "gym_douce", "week_start")
+
+    def __init__(self, id, title, weekday, start, end, capacity):
+        self.id = id
+        self.title = title
+        self.weekday = weekday
+        self.start = start
+        self.end = end
+        self.capacity = capacity
+        self.gym_douce = "gym douce" in title.lower()
+        # Minutes from Monday 00:00 to the start of the course
+        self.week_start = weekday * MINUTES_PER_DAY + start
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row["id"], row["title"], row["weekday"], parse_time(row["start_time"]),
+                   parse_time(row["end_time"]), row["capacity"])
+
+    @property
+    def start_time(self):
+        return format_time(self.start)
+
+    @property
+    def end_time(self):
+        return format_time(self.end)
+
+    def __repr__(self):
+        return f"Slot({self.id}, {self.title!r}, {self.weekday}, {self.start_time}-{self.end_time})"
+
+def first_open_week(today):
+    """
+    The first week of the planning: the current ISO week, or the next one on
+    Saturday and Sunday. Every week before it is finished.
+    """
+    if today.weekday() in [5, 6]:
+        today += datetime.timedelta(days=7 - today.weekday())
+    iso_info = today.isocalendar()
+    return iso_info[1], iso_info[0]
+
+def planning_week_count(secrets):
+    "Number of weeks open for booking: [planning] weeks of the secrets (3 by default)."
+    return secrets.get("planning", {}).get("weeks", 3)
+
+def planning_weeks(today, count):
+    "(week_num, year) of the `count` weeks of the planning, from first_open_week(today)."
+    week_num, year = first_open_week(today)
+    monday = datetime.date.fromisocalendar(year, week_num, 1)
+    weeks = []
+    for n in range(count):
+        iso_info = (monday + datetime.timedelta(weeks=n)).isocalendar()
+        weeks.append((iso_info[1], iso_info[0]))
+    return weeks
+
+def load_slots(rows):
+    return [Slot.from_row(row) for row in rows]
+
+def minutes_into_week(now, week_num, year):
+    """
+    Wall-clock minutes from the Monday 00:00 of an ISO week to `now`:
+    negative before the week, above 7 days after it.
+    """
+    monday = datetime.date.fromisocalendar(year, week_num, 1)
+    return (datetime.date(now.year, now.month, now.day) - monday).days * MINUTES_PER_DAY \
+        + now.hour * 60 + now.minute
+
+def is_open(slot, now_minutes):
+    "True if the slot starts at least BOOKING_DELAY minutes after `now_minutes` (see minutes_into_week)."
+    return slot.week_start - now_minutes >= BOOKING_DELAY
+
+def is_reservation_allowed(slot, week_num, year, now):
+    "Booking/cancellation is only allowed if the course of the given week is at least 2 hours away."
+    return is_open(slot, minutes_into_week(now, week_num, year))
+
+def week_eligibility(slots, week_num, year, now, closures=frozenset(), gym_douce_only=False):
+    """
+    Whether each slot of an ISO week can be booked at `now`, as {slot id:
+    None if it can, else "bank_holiday", "club_closed" or "closed" (course
+    started, or less than 2 hours away)}. `closures` are the club-specific
+    closure dates; with `gym_douce_only`, the other slots are left out.
+    """
+    now_minutes = minutes_into_week(now, week_num, year)
+    day_status = {}
+    for weekday, day in enumerate(week_dates(week_num, year, 7)):
+        if is_bank_holiday_fr(day):
+            day_status[weekday] = "bank_holiday"
+        elif day in closures:
+            day_status[weekday] = "club_closed"
+
+    eligibility = {}
+    for slot in slots:
+        if gym_douce_only and not slot.gym_douce:
+            continue
+        status = day_status.get(slot.weekday)
+        if status is None and not is_open(slot, now_minutes):
+            status = "closed"
+        eligibility[slot.id] = status
+    return eligibility
@@ -0,0 +1,33 @@
+-- Tables of the app, as created on Supabase before migrations were tracked
+-- in the repository. Every statement is a no-op on an existing database.
+
+create table if not exists public.users (
+    id bigint generated by default as identity primary key,
+    created_at timestamptz not null default now(),
+    nom text not null,
+    email text not null,
+    password text not null,
+    role text not null default 'user' check (role in ('user', 'coach', 'admin')),
+    formula int not null default 1,
+    gym_douce_only boolean not null default false
+);
+
+create table if not exists public.courseslot (
+    id bigint generated by default as identity primary key,
+    title text not null,
+    weekday int not null check (weekday between 0 and 6),
+    start_time text not null,
+    end_time text not null,
+    capacity int not null check (capacity > 0)
+);
+
+create table if not exists public.reservation (
+    id bigint generated by default as identity primary key,
+    created_at timestamptz not null default now(),
+    user_id bigint not null references public.users (id) on delete cascade,
+    course_id bigint not null references public.courseslot (id) on delete cascade,
+    waitlist boolean not null default false,
+    cancelled boolean not null default false,
+    week_num int not null,
+    year int not null
+);
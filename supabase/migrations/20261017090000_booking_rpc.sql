@@ -0,0 +1,139 @@
+-- Atomic booking and cancellation, called from app.py through supabase.rpc().
+--
+-- Both functions run in a single transaction and lock the user row then the
+-- course slot row, so concurrent bookings of the same slot (or by the same
+-- user) are serialized and capacity / formula limits cannot be exceeded.
+
+-- French bank holidays (fixed dates + Easter Monday, Ascension, Pentecost Monday)
+create or replace function public.is_bank_holiday_fr(p_date date)
+returns boolean
+language plpgsql
+immutable
+as $$
+declare
+    y int := extract(year from p_date);
+    a int; b int; c int; d int; e int; f int; g int; h int; j int; k int; m int;
+    easter date;
+begin
+    if to_char(p_date, 'MM-DD') in ('01-01', '05-01', '05-08', '07-14',
+                                    '08-15', '11-01', '11-11', '12-25') then
+        return true;
+    end if;
+
+    a := y / 100;
+    b := y % 100;
+    c := (3 * (a + 25)) / 4;
+    d := (3 * (a + 25)) % 4;
+    e := (8 * (a + 11)) / 25;
+    f := (5 * a + b) % 19;
+    g := (19 * f + c - e) % 30;
+    h := (f + 11 * g) / 319;
+    j := (60 * (5 - d) + b) / 4;
+    k := (60 * (5 - d) + b) % 4;
+    m := (2 * j - k - g + h) % 7;
+    if m < 0 then
+        m := m + 7;
+    end if;
+    easter := make_date(y, (g - h + m + 114) / 31, (g - h + m + 114) % 31 + 1);
+
+    return p_date in (easter + 1, easter + 39, easter + 50);
+end;
+$$;
+
+-- Start of a course slot for a given ISO week, in the club's time zone
+create or replace function public.slot_start_at(p_weekday int, p_start_time text,
+                                                p_week_num int, p_year int)
+returns timestamptz
+language sql
+immutable
+as $$
+    select (to_date(p_year || '-' || p_week_num, 'IYYY-IW') + p_weekday
+            + p_start_time::time) at time zone 'Europe/Paris';
+$$;
+
+-- Book a slot for a user.
+-- Returns one of: 'confirmed', 'waitlist', 'already_booked', 'quota_reached',
+-- 'bank_holiday', 'closed', 'not_found'.
+create or replace function public.book_reservation(p_user_id bigint, p_course_id bigint,
+                                                   p_week_num int, p_year int)
+returns text
+language plpgsql
+as $$
+declare
+    v_user users%rowtype;
+    v_slot courseslot%rowtype;
+    v_booked int;
+    v_user_booked int;
+begin
+    select * into v_user from users where id = p_user_id for update;
+    select * into v_slot from courseslot where id = p_course_id for update;
+    if v_user.id is null or v_slot.id is null then
+        return 'not_found';
+    end if;
+
+    if is_bank_holiday_fr(to_date(p_year || '-' || p_week_num, 'IYYY-IW') + v_slot.weekday) then
+        return 'bank_holiday';
+    end if;
+
+    if slot_start_at(v_slot.weekday, v_slot.start_time::text, p_week_num, p_year)
+            < now() + interval '2 hours' then
+        return 'closed';
+    end if;
+
+    if exists (select 1 from reservation
+               where user_id = p_user_id and course_id = p_course_id
+                 and cancelled = false and week_num = p_week_num and year = p_year) then
+        return 'already_booked';
+    end if;
+
+    select count(*) into v_booked from reservation
+    where course_id = p_course_id and cancelled = false and waitlist = false
+      and week_num = p_week_num and year = p_year;
+
+    if v_booked >= v_slot.capacity then
+        insert into reservation (user_id, course_id, waitlist, cancelled, week_num, year)
+        values (p_user_id, p_course_id, true, false, p_week_num, p_year);
+        return 'waitlist';
+    end if;
+
+    select count(*) into v_user_booked from reservation
+    where user_id = p_user_id and cancelled = false and waitlist = false
+      and week_num = p_week_num and year = p_year;
+
+    if v_user_booked >= v_user.formula then
+        return 'quota_reached';
+    end if;
+
+    insert into reservation (user_id, course_id, waitlist, cancelled, week_num, year)
+    values (p_user_id, p_course_id, false, false, p_week_num, p_year);
+    return 'confirmed';
+end;
+$$;
+
+-- Cancel a reservation (confirmed or waitlisted) of a user.
+-- Returns one of: 'cancelled', 'closed', 'not_found'.
+create or replace function public.cancel_reservation(p_reservation_id bigint, p_user_id bigint)
+returns text
+language plpgsql
+as $$
+declare
+    v_res reservation%rowtype;
+    v_slot courseslot%rowtype;
+begin
+    select * into v_res from reservation
+    where id = p_reservation_id and user_id = p_user_id and cancelled = false
+    for update;
+    if v_res.id is null then
+        return 'not_found';
+    end if;
+
+    select * into v_slot from courseslot where id = v_res.course_id for update;
+    if slot_start_at(v_slot.weekday, v_slot.start_time::text, v_res.week_num, v_res.year)
+            < now() + interval '2 hours' then
+        return 'closed';
+    end if;
+
+    update reservation set cancelled = true where id = p_reservation_id;
+    return 'cancelled';
+end;
+$$;
@@ -0,0 +1,120 @@
+-- Waitlist promotion engine.
+--
+-- promote_waitlist() fills the free places of a slot for a given week with the
+-- oldest waitlisted reservations whose user still has room in their formula.
+-- It runs in the caller's transaction: from cancel_reservation() when a
+-- confirmed place is freed, and from a trigger when the capacity of a course
+-- is increased (which may promote several people at once).
+
+create table if not exists public.reservation_event (
+    id bigint generated always as identity primary key,
+    reservation_id bigint not null references public.reservation (id) on delete cascade,
+    kind text not null,
+    created_at timestamptz not null default now()
+);
+
+-- Returns the number of promoted reservations.
+create or replace function public.promote_waitlist(p_course_id bigint, p_week_num int, p_year int)
+returns int
+language plpgsql
+as $$
+declare
+    v_capacity int;
+    v_free int;
+    v_promoted int := 0;
+    v_user_booked int;
+    r record;
+begin
+    select capacity into v_capacity from courseslot where id = p_course_id for update;
+    if v_capacity is null then
+        return 0;
+    end if;
+
+    select v_capacity - count(*) into v_free from reservation
+    where course_id = p_course_id and cancelled = false and waitlist = false
+      and week_num = p_week_num and year = p_year;
+
+    for r in
+        select res.id, res.user_id, u.formula
+        from reservation res
+        join users u on u.id = res.user_id
+        where res.course_id = p_course_id and res.cancelled = false and res.waitlist = true
+          and res.week_num = p_week_num and res.year = p_year
+        order by res.created_at, res.id
+        for update of res
+    loop
+        exit when v_free <= 0;
+
+        -- Users currently booking elsewhere hold their row lock (see
+        -- book_reservation); skip them rather than risk a deadlock.
+        perform 1 from users where id = r.user_id for update skip locked;
+        continue when not found;
+
+        select count(*) into v_user_booked from reservation
+        where user_id = r.user_id and cancelled = false and waitlist = false
+          and week_num = p_week_num and year = p_year;
+        continue when v_user_booked >= r.formula;
+
+        update reservation set waitlist = false where id = r.id;
+        insert into reservation_event (reservation_id, kind) values (r.id, 'promoted');
+        v_free := v_free - 1;
+        v_promoted := v_promoted + 1;
+    end loop;
+
+    return v_promoted;
+end;
+$$;
+
+create or replace function public.cancel_reservation(p_reservation_id bigint, p_user_id bigint)
+returns text
+language plpgsql
+as $$
+declare
+    v_res reservation%rowtype;
+    v_slot courseslot%rowtype;
+begin
+    select * into v_res from reservation
+    where id = p_reservation_id and user_id = p_user_id and cancelled = false
+    for update;
+    if v_res.id is null then
+        return 'not_found';
+    end if;
+
+    select * into v_slot from courseslot where id = v_res.course_id for update;
+    if slot_start_at(v_slot.weekday, v_slot.start_time::text, v_res.week_num, v_res.year)
+            < now() + interval '2 hours' then
+        return 'closed';
+    end if;
+
+    update reservation set cancelled = true where id = p_reservation_id;
+    if not v_res.waitlist then
+        perform promote_waitlist(v_res.course_id, v_res.week_num, v_res.year);
+    end if;
+    return 'cancelled';
+end;
+$$;
+
+-- Promote waitlisted users of every week when a course gets more places
+create or replace function public.courseslot_capacity_promote()
+returns trigger
+language plpgsql
+as $$
+declare
+    w record;
+begin
+    for w in
+        select distinct week_num, year from reservation
+        where course_id = new.id and cancelled = false and waitlist = true
+    loop
+        perform promote_waitlist(new.id, w.week_num, w.year);
+    end loop;
+    return null;
+end;
+$$;
+
+drop trigger if exists courseslot_capacity_promote on public.courseslot;
+create trigger courseslot_capacity_promote
+    after update of capacity on public.courseslot
+    for each row
+    when (new.capacity > old.capacity)
+    execute function public.courseslot_capacity_promote();
@@ -0,0 +1,72 @@
+-- Club-specific closure dates (holidays of the coaches, gym unavailable...),
+-- managed from the admin tab and checked by book_reservation() on top of the
+-- French bank holidays.
+
+create table if not exists public.closure (
+    day date primary key,
+    reason text
+);
+
+-- Book a slot for a user.
+-- Returns one of: 'confirmed', 'waitlist', 'already_booked', 'quota_reached',
+-- 'bank_holiday', 'club_closed', 'closed', 'not_found'.
+create or replace function public.book_reservation(p_user_id bigint, p_course_id bigint,
+                                                   p_week_num int, p_year int)
+returns text
+language plpgsql
+as $$
+declare
+    v_user users%rowtype;
+    v_slot courseslot%rowtype;
+    v_booked int;
+    v_user_booked int;
+    v_day date;
+begin
+    select * into v_user from users where id = p_user_id for update;
+    select * into v_slot from courseslot where id = p_course_id for update;
+    if v_user.id is null or v_slot.id is null then
+        return 'not_found';
+    end if;
+
+    v_day := to_date(p_year || '-' || p_week_num, 'IYYY-IW') + v_slot.weekday;
+    if is_bank_holiday_fr(v_day) then
+        return 'bank_holiday';
+    end if;
+    if exists (select 1 from closure where day = v_day) then
+        return 'club_closed';
+    end if;
+
+    if slot_start_at(v_slot.weekday, v_slot.start_time::text, p_week_num, p_year)
+            < now() + interval '2 hours' then
+        return 'closed';
+    end if;
+
+    if exists (select 1 from reservation
+               where user_id = p_user_id and course_id = p_course_id
+                 and cancelled = false and week_num = p_week_num and year = p_year) then
+        return 'already_booked';
+    end if;
+
+    select count(*) into v_booked from reservation
+    where course_id = p_course_id and cancelled = false and waitlist = false
+      and week_num = p_week_num and year = p_year;
+
+    if v_booked >= v_slot.capacity then
+        insert into reservation (user_id, course_id, waitlist, cancelled, week_num, year)
+        values (p_user_id, p_course_id, true, false, p_week_num, p_year);
+        return 'waitlist';
+    end if;
+
+    select count(*) into v_user_booked from reservation
+    where user_id = p_user_id and cancelled = false and waitlist = false
+      and week_num = p_week_num and year = p_year;
+
+    if v_user_booked >= v_user.formula then
+        return 'quota_reached';
+    end if;
+
+    insert into reservation (user_id, course_id, waitlist, cancelled, week_num, year)
+    values (p_user_id, p_course_id, false, false, p_week_num, p_year);
+    return 'confirmed';
+end;
+$$;
@@ -0,0 +1,108 @@
+-- Incremental rollover of finished weeks.
+--
+-- Instead of wiping the reservation table every Saturday, the rows of finished
+-- weeks are moved in batches to reservation_archive, so the hot table only
+-- holds the planning horizon and the attendance history is kept for
+-- reporting. Each batch is its own transaction; a run interrupted half-way is
+-- resumed by the next start_rollover() call for the same cutoff week.
+
+create table if not exists public.reservation_archive (
+    id bigint primary key,
+    created_at timestamptz,
+    user_id bigint,
+    course_id bigint,
+    waitlist boolean not null,
+    cancelled boolean not null,
+    week_num smallint not null,
+    year smallint not null,
+    archived_at timestamptz not null default now()
+);
+
+create index if not exists reservation_archive_year_week_idx
+    on public.reservation_archive (year, week_num, course_id);
+
+create table if not exists public.rollover_run (
+    id bigint generated always as identity primary key,
+    cutoff_week int not null,
+    cutoff_year int not null,
+    started_at timestamptz not null default now(),
+    finished_at timestamptz,
+    batches int not null default 0,
+    moved int not null default 0
+);
+
+-- Promotion events are history too: keep them when their reservation is archived
+alter table public.reservation_event
+    drop constraint if exists reservation_event_reservation_id_fkey;
+
+-- Start (or resume) the rollover of every week before the given one.
+create or replace function public.start_rollover(p_week_num int, p_year int)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_run_id bigint;
+begin
+    select id into v_run_id from rollover_run
+    where cutoff_week = p_week_num and cutoff_year = p_year and finished_at is null
+    order by id desc limit 1;
+
+    if v_run_id is null then
+        insert into rollover_run (cutoff_week, cutoff_year)
+        values (p_week_num, p_year)
+        returning id into v_run_id;
+    end if;
+    return v_run_id;
+end;
+$$;
+
+-- Move one batch of finished reservations to the archive.
+-- Returns the number of moved rows (0 once the run is complete).
+create or replace function public.rollover_batch(p_run_id bigint, p_batch_size int default 1000)
+returns int
+language plpgsql
+as $$
+declare
+    v_run rollover_run%rowtype;
+    v_moved int;
+begin
+    select * into v_run from rollover_run where id = p_run_id for update;
+    if v_run.id is null or v_run.finished_at is not null then
+        return 0;
+    end if;
+
+    with batch as (
+        select id from reservation
+        where (year, week_num) < (v_run.cutoff_year, v_run.cutoff_week)
+        order by year, week_num, id
+        limit p_batch_size
+        for update skip locked
+    ), moved as (
+        delete from reservation r using batch
+        where r.id = batch.id
+        returning r.id, r.created_at, r.user_id, r.course_id, r.waitlist,
+                  r.cancelled, r.week_num, r.year
+    ), archived as (
+        insert into reservation_archive (id, created_at, user_id, course_id, waitlist,
+                                         cancelled, week_num, year)
+        select * from moved
+        on conflict (id) do nothing
+    )
+    select count(*) into v_moved from moved;
+
+    if v_moved > 0 then
+        update rollover_run
+        set batches = batches + 1, moved = moved + v_moved
+        where id = p_run_id;
+    end if;
+    return v_moved;
+end;
+$$;
+
+create or replace function public.finish_rollover(p_run_id bigint)
+returns void
+language sql
+as $$
+    update rollover_run set finished_at = now()
+    where id = p_run_id and finished_at is null;
+$$;
@@ -0,0 +1,71 @@
+-- Attendance rollups for the admin statistics tab.
+--
+-- One row per (course, week) with the number of confirmed, waitlisted and
+-- cancelled reservations, maintained incrementally by a trigger on every
+-- reservation write. Archiving a week (rollover) deletes its reservations but
+-- leaves the rollups untouched.
+
+create table if not exists public.attendance_rollup (
+    course_id bigint not null,
+    year smallint not null,
+    week_num smallint not null,
+    confirmed int not null default 0,
+    waitlisted int not null default 0,
+    cancelled int not null default 0,
+    primary key (course_id, year, week_num)
+);
+
+create or replace function public.attendance_rollup_apply(p_course_id bigint, p_year int, p_week_num int,
+                                                          p_waitlist boolean, p_cancelled boolean,
+                                                          p_sign int)
+returns void
+language sql
+as $$
+    insert into attendance_rollup (course_id, year, week_num, confirmed, waitlisted, cancelled)
+    values (p_course_id, p_year, p_week_num,
+            case when not p_cancelled and not p_waitlist then p_sign else 0 end,
+            case when not p_cancelled and p_waitlist then p_sign else 0 end,
+            case when p_cancelled then p_sign else 0 end)
+    on conflict (course_id, year, week_num) do update
+    set confirmed = attendance_rollup.confirmed + excluded.confirmed,
+        waitlisted = attendance_rollup.waitlisted + excluded.waitlisted,
+        cancelled = attendance_rollup.cancelled + excluded.cancelled;
+$$;
+
+create or replace function public.reservation_rollup()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op = 'UPDATE' then
+        if (old.course_id, old.year, old.week_num, old.waitlist, old.cancelled)
+                is not distinct from (new.course_id, new.year, new.week_num, new.waitlist, new.cancelled) then
+            return null;
+        end if;
+        perform attendance_rollup_apply(old.course_id, old.year, old.week_num, old.waitlist, old.cancelled, -1);
+    end if;
+    perform attendance_rollup_apply(new.course_id, new.year, new.week_num, new.waitlist, new.cancelled, 1);
+    return null;
+end;
+$$;
+
+drop trigger if exists reservation_rollup on public.reservation;
+create trigger reservation_rollup
+    after insert or update on public.reservation
+    for each row
+    execute function public.reservation_rollup();
+
+-- Backfill from the current and archived reservations
+truncate public.attendance_rollup;
+insert into public.attendance_rollup (course_id, year, week_num, confirmed, waitlisted, cancelled)
+select course_id, year, week_num,
+       count(*) filter (where not cancelled and not waitlist),
+       count(*) filter (where not cancelled and waitlist),
+       count(*) filter (where cancelled)
+from (
+    select course_id, year, week_num, waitlist, cancelled from public.reservation
+    union all
+    select course_id, year, week_num, waitlist, cancelled from public.reservation_archive
+) r
+where course_id is not null
+group by course_id, year, week_num;
@@ -0,0 +1,49 @@
+-- Indexes matching the filters of the hot queries (see check_indexes.py)
+-- and uniqueness of active bookings.
+
+-- Duplicate active bookings can't be created any more through
+-- book_reservation(), but older ones may exist: keep the oldest.
+update public.reservation set cancelled = true
+where id in (
+    select id from (
+        select id, row_number() over (partition by user_id, course_id, week_num, year
+                                      order by created_at, id) as rank
+        from public.reservation
+        where not cancelled
+    ) duplicates
+    where rank > 1
+);
+
+-- One active (confirmed or waitlisted) booking per user, course and week;
+-- also serves the "already booked" check of book_reservation()
+create unique index if not exists reservation_active_unique
+    on public.reservation (user_id, course_id, year, week_num)
+    where not cancelled;
+
+-- Planning, roster and occupancy of a week:
+-- cancelled = false and week_num = ? and year = ? [and course_id = ? and waitlist = ?]
+create index if not exists reservation_active_week_idx
+    on public.reservation (year, week_num, course_id, waitlist)
+    include (user_id)
+    where not cancelled;
+
+-- Formula quota of a user: user_id = ? and cancelled = false and week_num = ? and year = ?
+create index if not exists reservation_active_user_week_idx
+    on public.reservation (user_id, year, week_num)
+    where not cancelled;
+
+-- Waitlist promotion, oldest first
+create index if not exists reservation_waitlist_idx
+    on public.reservation (course_id, year, week_num, created_at, id)
+    where waitlist and not cancelled;
+
+-- Rollover of finished weeks (cancelled rows included)
+create index if not exists reservation_year_week_idx
+    on public.reservation (year, week_num, id);
+
+-- Login by email
+create unique index if not exists users_email_key on public.users (email);
+
+-- Statistics of a season: year between ? and ?
+create index if not exists attendance_rollup_year_week_idx
+    on public.attendance_rollup (year, week_num);
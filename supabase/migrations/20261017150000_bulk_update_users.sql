@@ -0,0 +1,30 @@
+-- Batch update of members, used by the CSV import (bulk_io.py).
+--
+-- p_rows is a JSON array of {id, nom, email, role, formula, gym_douce_only,
+-- password?}. An upsert can't be used: it would need the password hash of
+-- every row, which the app never loads. The password is only changed when
+-- given.
+
+create or replace function public.bulk_update_users(p_rows jsonb)
+returns int
+language plpgsql
+as $$
+declare
+    v_updated int;
+begin
+    update users u
+    set nom = r.nom,
+        email = r.email,
+        role = r.role,
+        formula = r.formula,
+        gym_douce_only = r.gym_douce_only,
+        password = coalesce(r.password, u.password)
+    from jsonb_to_recordset(p_rows)
+        as r(id bigint, nom text, email text, role text, formula int,
+             gym_douce_only boolean, password text)
+    where u.id = r.id;
+
+    get diagnostics v_updated = row_count;
+    return v_updated;
+end;
+$$;
@@ -0,0 +1,13 @@
+-- Indexes of the paged member listing of the admin tab (UserRepo.search):
+-- order by nom, id with offset/limit, optionally filtered by role and by a
+-- substring of the name or email (ilike '%...%').
+
+create extension if not exists pg_trgm;
+
+-- Page of the whole listing, or of one role
+create index if not exists users_nom_id_idx on public.users (nom, id);
+create index if not exists users_role_nom_id_idx on public.users (role, nom, id);
+
+-- nom ilike '%...%' or email ilike '%...%'
+create index if not exists users_nom_trgm_idx on public.users using gin (nom gin_trgm_ops);
+create index if not exists users_email_trgm_idx on public.users using gin (email gin_trgm_ops);
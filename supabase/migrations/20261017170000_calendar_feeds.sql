@@ -0,0 +1,97 @@
+-- iCalendar subscription feeds (ics_server.py).
+--
+-- Every user gets a secret token, the only credential of their feed URL.
+-- calendar_version holds one counter per feed, bumped by the writes that
+-- change its content:
+--   'user:<id>'  the reservations of a member (member feed)
+--   'roster'     any reservation, or a member's name (coach feed)
+--   'schedule'   the course slots and the club closures (both feeds)
+-- The feed server answers with a 304 as long as these counters don't move.
+
+alter table public.users
+    add column if not exists calendar_token uuid not null default gen_random_uuid();
+create unique index if not exists users_calendar_token_key on public.users (calendar_token);
+
+create table if not exists public.calendar_version (
+    feed text primary key,
+    version bigint not null default 0,
+    updated_at timestamptz not null default now()
+);
+
+create or replace function public.bump_calendar_versions(p_feeds text[])
+returns void
+language sql
+as $$
+    insert into calendar_version (feed, version)
+    select distinct feed, 1 from unnest(p_feeds) as feed
+    on conflict (feed) do update
+    set version = calendar_version.version + 1,
+        updated_at = now();
+$$;
+
+-- Statement-level, so that a rollover batch bumps each member once
+create or replace function public.reservation_calendar_bump()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op = 'INSERT' then
+        perform bump_calendar_versions(array(select 'user:' || user_id from new_rows) || 'roster'::text);
+    elsif tg_op = 'UPDATE' then
+        perform bump_calendar_versions(array(select 'user:' || user_id from new_rows
+                                             union select 'user:' || user_id from old_rows) || 'roster'::text);
+    else
+        perform bump_calendar_versions(array(select 'user:' || user_id from old_rows) || 'roster'::text);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists reservation_calendar_insert on public.reservation;
+create trigger reservation_calendar_insert
+    after insert on public.reservation
+    referencing new table as new_rows
+    for each statement
+    execute function public.reservation_calendar_bump();
+
+drop trigger if exists reservation_calendar_update on public.reservation;
+create trigger reservation_calendar_update
+    after update on public.reservation
+    referencing old table as old_rows new table as new_rows
+    for each statement
+    execute function public.reservation_calendar_bump();
+
+drop trigger if exists reservation_calendar_delete on public.reservation;
+create trigger reservation_calendar_delete
+    after delete on public.reservation
+    referencing old table as old_rows
+    for each statement
+    execute function public.reservation_calendar_bump();
+
+create or replace function public.calendar_bump_feed()
+returns trigger
+language plpgsql
+as $$
+begin
+    perform bump_calendar_versions(array[tg_argv[0]]);
+    return null;
+end;
+$$;
+
+drop trigger if exists courseslot_calendar on public.courseslot;
+create trigger courseslot_calendar
+    after insert or update or delete on public.courseslot
+    for each statement
+    execute function public.calendar_bump_feed('schedule');
+
+drop trigger if exists closure_calendar on public.closure;
+create trigger closure_calendar
+    after insert or update or delete on public.closure
+    for each statement
+    execute function public.calendar_bump_feed('schedule');
+
+drop trigger if exists users_calendar on public.users;
+create trigger users_calendar
+    after update of nom or delete on public.users
+    for each statement
+    execute function public.calendar_bump_feed('roster');
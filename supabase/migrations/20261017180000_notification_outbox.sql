@@ -0,0 +1,161 @@
+-- Transactional outbox of the email notifications.
+--
+-- Triggers enqueue a notification in the same transaction as the write that
+-- causes it (booking, cancellation, waitlist promotion, course deleted, club
+-- closed), so nothing is sent for a rolled back write and nothing is lost for
+-- a committed one. outbox_worker.py drains the queue outside of the app:
+--   claim_notifications()     locks a batch (lease), oldest first
+--   complete_notifications()  marks the sent ones
+--   fail_notification()       schedules a retry, or gives up
+
+create table if not exists public.notification_outbox (
+    id bigint generated always as identity primary key,
+    kind text not null,
+    user_id bigint not null references public.users (id) on delete cascade,
+    payload jsonb not null,
+    created_at timestamptz not null default now(),
+    available_at timestamptz not null default now(),
+    locked_until timestamptz,
+    attempts int not null default 0,
+    last_error text,
+    sent_at timestamptz,
+    failed_at timestamptz
+);
+
+-- Pending notifications, oldest first
+create index if not exists notification_outbox_pending_idx
+    on public.notification_outbox (available_at, id)
+    where sent_at is null and failed_at is null;
+
+create or replace function public.enqueue_notification(p_kind text, p_user_id bigint, p_course_id bigint,
+                                                       p_week_num int, p_year int)
+returns void
+language sql
+as $$
+    insert into notification_outbox (kind, user_id, payload)
+    select p_kind, u.id, jsonb_build_object(
+        'email', u.email,
+        'nom', u.nom,
+        'title', s.title,
+        'day', to_date(p_year || '-' || p_week_num, 'IYYY-IW') + s.weekday,
+        'start_time', s.start_time,
+        'end_time', s.end_time,
+        'course_id', s.id,
+        'week_num', p_week_num,
+        'year', p_year)
+    from users u, courseslot s
+    where u.id = p_user_id and s.id = p_course_id;
+$$;
+
+create or replace function public.reservation_notify()
+returns trigger
+language plpgsql
+as $$
+declare
+    v_kind text;
+begin
+    if tg_op = 'INSERT' then
+        v_kind := case when new.waitlist then 'waitlisted' else 'confirmed' end;
+    elsif new.cancelled and not old.cancelled then
+        v_kind := 'cancelled';
+    elsif old.waitlist and not new.waitlist and not new.cancelled then
+        v_kind := 'promoted';
+    else
+        return null;
+    end if;
+    perform enqueue_notification(v_kind, new.user_id, new.course_id, new.week_num, new.year);
+    return null;
+end;
+$$;
+
+drop trigger if exists reservation_notify on public.reservation;
+create trigger reservation_notify
+    after insert or update of waitlist, cancelled on public.reservation
+    for each row
+    execute function public.reservation_notify();
+
+-- A deleted course cascades to its reservations: tell the booked members first
+create or replace function public.courseslot_notify_deleted()
+returns trigger
+language plpgsql
+as $$
+begin
+    perform enqueue_notification('course_cancelled', r.user_id, r.course_id, r.week_num, r.year)
+    from reservation r
+    where r.course_id = old.id and not r.cancelled
+      and slot_start_at(old.weekday, old.start_time::text, r.week_num, r.year) > now();
+    return old;
+end;
+$$;
+
+drop trigger if exists courseslot_notify_deleted on public.courseslot;
+create trigger courseslot_notify_deleted
+    before delete on public.courseslot
+    for each row
+    execute function public.courseslot_notify_deleted();
+
+create or replace function public.closure_notify()
+returns trigger
+language plpgsql
+as $$
+begin
+    perform enqueue_notification('club_closed', r.user_id, r.course_id, r.week_num, r.year)
+    from reservation r
+    join courseslot s on s.id = r.course_id
+    where not r.cancelled
+      and r.year = extract(isoyear from new.day) and r.week_num = extract(week from new.day)
+      and s.weekday = extract(isodow from new.day) - 1;
+    return null;
+end;
+$$;
+
+drop trigger if exists closure_notify on public.closure;
+create trigger closure_notify
+    after insert on public.closure
+    for each row
+    execute function public.closure_notify();
+
+create or replace function public.claim_notifications(p_batch_size int, p_lease_seconds int)
+returns setof public.notification_outbox
+language sql
+as $$
+    update notification_outbox n
+    set locked_until = now() + make_interval(secs => p_lease_seconds),
+        attempts = n.attempts + 1
+    where n.id in (
+        select id from notification_outbox
+        where sent_at is null and failed_at is null and available_at <= now()
+          and (locked_until is null or locked_until < now())
+        order by available_at, id
+        limit p_batch_size
+        for update skip locked
+    )
+    returning n.*;
+$$;
+
+create or replace function public.complete_notifications(p_ids bigint[])
+returns int
+language sql
+as $$
+    with sent as (
+        update notification_outbox
+        set sent_at = now(), locked_until = null, last_error = null
+        where id = any(p_ids)
+        returning 1
+    )
+    select count(*)::int from sent;
+$$;
+
+-- p_retry_seconds null: give up (failed_at is set)
+create or replace function public.fail_notification(p_id bigint, p_error text, p_retry_seconds int)
+returns void
+language sql
+as $$
+    update notification_outbox
+    set last_error = p_error,
+        locked_until = null,
+        available_at = case when p_retry_seconds is null then available_at
+                            else now() + make_interval(secs => p_retry_seconds) end,
+        failed_at = case when p_retry_seconds is null then now() end
+    where id = p_id;
+$$;
@@ -0,0 +1,21 @@
+-- A capacity increase only promotes the waitlists of weeks whose course is
+-- still open (at least 2 hours away), like cancel_reservation(): the weeks
+-- already past or about to start are left as they are.
+create or replace function public.courseslot_capacity_promote()
+returns trigger
+language plpgsql
+as $$
+declare
+    w record;
+begin
+    for w in
+        select distinct week_num, year from reservation
+        where course_id = new.id and cancelled = false and waitlist = true
+          and slot_start_at(new.weekday, new.start_time::text, week_num, year)
+              >= now() + interval '2 hours'
+    loop
+        perform promote_waitlist(new.id, w.week_num, w.year);
+    end loop;
+    return null;
+end;
+$$;
@@ -0,0 +1,22 @@
+-- The member feed is named after the member: a rename bumps 'user:<id>' too
+-- (not only 'roster'), so that the feed server stops answering 304 with the
+-- old name. Statement-level like the reservation triggers, for bulk updates;
+-- transition tables can't be combined with "update of nom", hence the join.
+create or replace function public.users_calendar_rename()
+returns trigger
+language plpgsql
+as $$
+begin
+    perform bump_calendar_versions(array(
+        select 'user:' || n.id from new_rows n join old_rows o on o.id = n.id
+        where n.nom is distinct from o.nom));
+    return null;
+end;
+$$;
+
+drop trigger if exists users_calendar_rename on public.users;
+create trigger users_calendar_rename
+    after update on public.users
+    referencing old table as old_rows new table as new_rows
+    for each statement
+    execute function public.users_calendar_rename();
@@ -0,0 +1,221 @@
+-- One lock order for every booking function, so that concurrent bookings,
+-- cancellations and promotions on a course wait for each other instead of
+-- deadlocking:
+--
+--   courseslot -> users (by id) -> reservation rows -> everything written by
+--   the triggers (calendar_version, attendance_rollup, ...)
+--
+-- The users of a waitlist are all locked before the first write, so that a
+-- promotion no longer skips a user whose row is busy (which could leave a
+-- freed place to a newcomer ahead of the waitlist).
+
+-- Locks the users waitlisted on a course for a week, by id.
+create or replace function public.lock_waitlisted_users(p_course_id bigint, p_week_num int, p_year int)
+returns void
+language plpgsql
+as $$
+begin
+    perform 1 from users
+    where id in (select user_id from reservation
+                 where course_id = p_course_id and cancelled = false and waitlist = true
+                   and week_num = p_week_num and year = p_year)
+    order by id
+    for update;
+end;
+$$;
+
+-- Book a slot for a user.
+-- Returns one of: 'confirmed', 'waitlist', 'already_booked', 'quota_reached',
+-- 'bank_holiday', 'club_closed', 'closed', 'not_found'.
+create or replace function public.book_reservation(p_user_id bigint, p_course_id bigint,
+                                                   p_week_num int, p_year int)
+returns text
+language plpgsql
+as $$
+declare
+    v_user users%rowtype;
+    v_slot courseslot%rowtype;
+    v_booked int;
+    v_user_booked int;
+    v_day date;
+begin
+    select * into v_slot from courseslot where id = p_course_id for update;
+    select * into v_user from users where id = p_user_id for update;
+    if v_user.id is null or v_slot.id is null then
+        return 'not_found';
+    end if;
+
+    v_day := to_date(p_year || '-' || p_week_num, 'IYYY-IW') + v_slot.weekday;
+    if is_bank_holiday_fr(v_day) then
+        return 'bank_holiday';
+    end if;
+    if exists (select 1 from closure where day = v_day) then
+        return 'club_closed';
+    end if;
+
+    if slot_start_at(v_slot.weekday, v_slot.start_time::text, p_week_num, p_year)
+            < now() + interval '2 hours' then
+        return 'closed';
+    end if;
+
+    if exists (select 1 from reservation
+               where user_id = p_user_id and course_id = p_course_id
+                 and cancelled = false and week_num = p_week_num and year = p_year) then
+        return 'already_booked';
+    end if;
+
+    select count(*) into v_booked from reservation
+    where course_id = p_course_id and cancelled = false and waitlist = false
+      and week_num = p_week_num and year = p_year;
+
+    if v_booked >= v_slot.capacity then
+        insert into reservation (user_id, course_id, waitlist, cancelled, week_num, year)
+        values (p_user_id, p_course_id, true, false, p_week_num, p_year);
+        return 'waitlist';
+    end if;
+
+    select count(*) into v_user_booked from reservation
+    where user_id = p_user_id and cancelled = false and waitlist = false
+      and week_num = p_week_num and year = p_year;
+
+    if v_user_booked >= v_user.formula then
+        return 'quota_reached';
+    end if;
+
+    insert into reservation (user_id, course_id, waitlist, cancelled, week_num, year)
+    values (p_user_id, p_course_id, false, false, p_week_num, p_year);
+    return 'confirmed';
+end;
+$$;
+
+-- Returns the number of promoted reservations.
+create or replace function public.promote_waitlist(p_course_id bigint, p_week_num int, p_year int)
+returns int
+language plpgsql
+as $$
+declare
+    v_capacity int;
+    v_free int;
+    v_promoted int := 0;
+    v_user_booked int;
+    r record;
+begin
+    select capacity into v_capacity from courseslot where id = p_course_id for update;
+    if v_capacity is null then
+        return 0;
+    end if;
+    perform lock_waitlisted_users(p_course_id, p_week_num, p_year);
+
+    select v_capacity - count(*) into v_free from reservation
+    where course_id = p_course_id and cancelled = false and waitlist = false
+      and week_num = p_week_num and year = p_year;
+
+    for r in
+        select res.id, res.user_id, u.formula
+        from reservation res
+        join users u on u.id = res.user_id
+        where res.course_id = p_course_id and res.cancelled = false and res.waitlist = true
+          and res.week_num = p_week_num and res.year = p_year
+        order by res.created_at, res.id
+        for update of res
+    loop
+        exit when v_free <= 0;
+
+        select count(*) into v_user_booked from reservation
+        where user_id = r.user_id and cancelled = false and waitlist = false
+          and week_num = p_week_num and year = p_year;
+        continue when v_user_booked >= r.formula;
+
+        update reservation set waitlist = false where id = r.id;
+        insert into reservation_event (reservation_id, kind) values (r.id, 'promoted');
+        v_free := v_free - 1;
+        v_promoted := v_promoted + 1;
+    end loop;
+
+    return v_promoted;
+end;
+$$;
+
+create or replace function public.cancel_reservation(p_reservation_id bigint, p_user_id bigint)
+returns text
+language plpgsql
+as $$
+declare
+    v_course_id bigint;
+    v_res reservation%rowtype;
+    v_slot courseslot%rowtype;
+begin
+    -- The course of a reservation never changes: find it without a lock,
+    -- lock it, then lock the reservation and check it again
+    select course_id into v_course_id from reservation
+    where id = p_reservation_id and user_id = p_user_id and cancelled = false;
+    if v_course_id is null then
+        return 'not_found';
+    end if;
+
+    select * into v_slot from courseslot where id = v_course_id for update;
+    select * into v_res from reservation
+    where id = p_reservation_id and user_id = p_user_id and cancelled = false
+    for update;
+    if v_res.id is null or v_slot.id is null then
+        return 'not_found';
+    end if;
+
+    if slot_start_at(v_slot.weekday, v_slot.start_time::text, v_res.week_num, v_res.year)
+            < now() + interval '2 hours' then
+        return 'closed';
+    end if;
+
+    if not v_res.waitlist then
+        perform lock_waitlisted_users(v_res.course_id, v_res.week_num, v_res.year);
+    end if;
+    update reservation set cancelled = true where id = p_reservation_id;
+    if not v_res.waitlist then
+        perform promote_waitlist(v_res.course_id, v_res.week_num, v_res.year);
+    end if;
+    return 'cancelled';
+end;
+$$;
+
+-- The updated courseslot row is already locked: lock the waitlisted users of
+-- every open week before the first promotion writes anything.
+create or replace function public.courseslot_capacity_promote()
+returns trigger
+language plpgsql
+as $$
+declare
+    w record;
+begin
+    perform 1 from users
+    where id in (select user_id from reservation
+                 where course_id = new.id and cancelled = false and waitlist = true
+                   and slot_start_at(new.weekday, new.start_time::text, week_num, year)
+                       >= now() + interval '2 hours')
+    order by id
+    for update;
+
+    for w in
+        select distinct week_num, year from reservation
+        where course_id = new.id and cancelled = false and waitlist = true
+          and slot_start_at(new.weekday, new.start_time::text, week_num, year)
+              >= now() + interval '2 hours'
+    loop
+        perform promote_waitlist(new.id, w.week_num, w.year);
+    end loop;
+    return null;
+end;
+$$;
+
+-- Counters bumped in a fixed order, for writes touching several feeds at once
+-- (rollover batches, bulk updates)
+create or replace function public.bump_calendar_versions(p_feeds text[])
+returns void
+language sql
+as $$
+    insert into calendar_version (feed, version)
+    select distinct feed, 1 from unnest(p_feeds) as feed
+    order by feed
+    on conflict (feed) do update
+    set version = calendar_version.version + 1,
+        updated_at = now();
+$$;
@@ -0,0 +1,145 @@
+"""
+The notification outbox worker against the in-memory FakeClient, with the
+MemoryTransport and the LocalSmtpServer stand-in, on a frozen clock.
+
+    python -m pytest test_outbox_worker.py
+"""
+import datetime
+import socket
+import pytest
+import outbox_worker
+from fake_supabase import FakeClient
+from notifications import LocalSmtpServer, MemoryTransport, SmtpTransport
+from outbox_worker import OutboxWorker, retry_delay
+from repositories import Repositories
+
+SENDER = "club@example.com"
+
+class Clock:
+    # A Wednesday; the course booked below is on Tuesday 20 October, not a bank holiday
+    def __init__(self):
+        self.now = datetime.datetime(2026, 10, 14, 10, 0, tzinfo=datetime.timezone.utc)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += datetime.timedelta(seconds=seconds)
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+@pytest.fixture
+def client(clock):
+    """
+    Three members booking the same 1-place course: one confirmation and two
+    waitlist notifications in the outbox.
+    """
+    client = FakeClient({
+        "users": [{"nom": f"Membre {n}", "email": f"membre{n}@example.com", "password": "-",
+                   "role": "user", "formula": 3, "gym_douce_only": False} for n in range(3)],
+        "courseslot": [{"title": "Boxe", "weekday": 1, "start_time": "18:00", "end_time": "19:00",
+                        "capacity": 1}],
+    }, now=clock)
+    year, week_num, _ = (clock.now.date() + datetime.timedelta(days=7)).isocalendar()
+    for user_id in (1, 2, 3):
+        client.rpc("book_reservation", {"p_user_id": user_id, "p_course_id": 1,
+                                        "p_week_num": week_num, "p_year": year}).execute()
+    return client
+
+def outbox(client):
+    return {n["payload"]["email"]: n for n in client.tables["notification_outbox"]}
+
+def test_outbox_follows_bookings(client):
+    assert [n["kind"] for n in client.tables["notification_outbox"]] == ["confirmed", "waitlisted", "waitlisted"]
+
+def test_sends_over_smtp(client):
+    server = LocalSmtpServer().start()
+    repos = Repositories(client)
+    worker = OutboxWorker(repos, SmtpTransport("127.0.0.1", server.port, starttls=False), SENDER,
+                          batch_size=2)
+    summary = worker.run(once=True)
+    server.shutdown()
+    server.server_close()
+    assert (summary["batches"], summary["sent"], summary["retried"]) == (2, 3, 0)
+    assert sorted(m["To"] for m in server.messages) == [f"membre{n}@example.com" for n in range(3)]
+    assert server.messages[0]["From"] == SENDER
+    assert server.messages[0]["Subject"] == "Réservation confirmée : Boxe du mardi 20 octobre (18:00-19:00)"
+    assert "Bonjour Membre 0," in server.messages[0].get_content()
+    assert repos.notifications.pending_count() == 0
+
+def test_rejected_recipient_retried_in_the_same_connection(client):
+    server = LocalSmtpServer(reject={"membre1@example.com"}).start()
+    worker = OutboxWorker(Repositories(client), SmtpTransport("127.0.0.1", server.port, starttls=False),
+                          SENDER)
+    summary = worker.run(once=True)
+    server.shutdown()
+    server.server_close()
+    assert (summary["sent"], summary["retried"], summary["given_up"]) == (2, 1, 0)
+    rejected = outbox(client)["membre1@example.com"]
+    assert rejected["sent_at"] is None and rejected["attempts"] == 1
+    assert "SMTPRecipientsRefused" in rejected["last_error"]
+
+def test_retry_with_backoff(client, clock):
+    transport = MemoryTransport(reject={"membre1@example.com"})
+    worker = OutboxWorker(Repositories(client), transport, SENDER)
+    worker.run(once=True)
+    rejected = outbox(client)["membre1@example.com"]
+    delay = datetime.datetime.fromisoformat(rejected["available_at"]) - clock.now
+    assert 0.8 * outbox_worker.BACKOFF_SECONDS <= delay.total_seconds() <= 1.2 * outbox_worker.BACKOFF_SECONDS
+
+    # Not claimed again before its retry time
+    assert worker.drain_batch() == 0
+    clock.advance(delay.total_seconds())
+    transport.reject.clear()
+    assert worker.drain_batch() == 1
+    assert outbox(client)["membre1@example.com"]["sent_at"] is not None
+    assert [m["To"] for m in transport.messages] == ["membre0@example.com", "membre2@example.com",
+                                                     "membre1@example.com"]
+
+def test_give_up_after_max_attempts(client, clock):
+    worker = OutboxWorker(Repositories(client), MemoryTransport(reject={"membre1@example.com"}), SENDER)
+    for _ in range(outbox_worker.MAX_ATTEMPTS):
+        worker.run(once=True)
+        clock.advance(outbox_worker.MAX_BACKOFF_SECONDS * 2)
+    rejected = outbox(client)["membre1@example.com"]
+    assert rejected["attempts"] == outbox_worker.MAX_ATTEMPTS
+    assert rejected["failed_at"] is not None
+    assert worker.metrics.given_up == 1
+    assert worker.metrics.retried == outbox_worker.MAX_ATTEMPTS - 1
+    assert worker.drain_batch() == 0
+
+def test_connection_failure_retries_the_whole_batch(client):
+    # A port nobody listens on
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    worker = OutboxWorker(Repositories(client), SmtpTransport("127.0.0.1", port, starttls=False, timeout=2),
+                          SENDER)
+    summary = worker.run(once=True)
+    assert (summary["sent"], summary["retried"], summary["given_up"]) == (0, 3, 0)
+    for n in client.tables["notification_outbox"]:
+        assert n["attempts"] == 1 and n["locked_until"] is None and n["sent_at"] is None
+        assert "ConnectionRefusedError" in n["last_error"]
+
+def test_retried_notifications_claimed_after_older_ones(client, clock):
+    repos = Repositories(client)
+    worker = OutboxWorker(repos, MemoryTransport(reject={"membre0@example.com"}), SENDER, batch_size=1)
+    worker.drain_batch()
+    clock.advance(3600)
+    # Claimed by (available_at, id): the retry of notification 1 comes last
+    assert [n["id"] for n in repos.notifications.claim(3, 60)] == [2, 3, 1]
+
+def test_expired_lease_is_claimed_again(client, clock):
+    repos = Repositories(client)
+    assert len(repos.notifications.claim(3, 60)) == 3
+    assert repos.notifications.claim(3, 60) == []
+    clock.advance(61)
+    assert [n["attempts"] for n in repos.notifications.claim(3, 60)] == [2, 2, 2]
+
+def test_retry_delay():
+    assert retry_delay(outbox_worker.MAX_ATTEMPTS) is None
+    for attempts in range(1, outbox_worker.MAX_ATTEMPTS):
+        base = min(outbox_worker.MAX_BACKOFF_SECONDS, outbox_worker.BACKOFF_SECONDS * 2 ** (attempts - 1))
+        assert 0.8 * base - 1 <= retry_delay(attempts) <= 1.2 * base
@@ -0,0 +1,75 @@
+"""
+Booking eligibility around the weekend rollover and the 2-hour rule, with
+the clock frozen by passing `now` explicitly.
+
+    python -m pytest test_schedule.py
+"""
+import datetime
+from schedule import (Slot, first_open_week, is_reservation_allowed, load_slots, minutes_into_week,
+                      parse_time, week_eligibility)
+
+def make_slots():
+    return load_slots([
+        {"id": 1, "title": "Boxe", "weekday": 0, "start_time": "00:00", "end_time": "01:00", "capacity": 10},
+        {"id": 2, "title": "Boxe", "weekday": 0, "start_time": "18:00", "end_time": "19:00", "capacity": 10},
+        {"id": 3, "title": "Gym douce", "weekday": 2, "start_time": "10:00:00", "end_time": "11:00:00",
+         "capacity": 5},
+        {"id": 4, "title": "Boxe", "weekday": 3, "start_time": "18:00", "end_time": "19:00", "capacity": 10},
+        {"id": 5, "title": "Boxe", "weekday": 4, "start_time": "18:00", "end_time": "19:00", "capacity": 10},
+    ])
+
+def test_parse_time():
+    assert parse_time("18:30") == 18 * 60 + 30
+    assert parse_time("09:05:00") == 9 * 60 + 5
+    slot = Slot.from_row({"id": 1, "title": "Gym Douce", "weekday": 2, "start_time": "10:00",
+                          "end_time": "11:15", "capacity": 5})
+    assert (slot.start_time, slot.end_time, slot.gym_douce) == ("10:00", "11:15", True)
+    assert slot.week_start == 2 * 24 * 60 + 10 * 60
+
+def test_saturday_and_sunday_open_the_next_week():
+    # Week 42 of 2026 runs from Monday 12 to Sunday 18 October
+    for now in (datetime.datetime(2026, 10, 17, 0, 0), datetime.datetime(2026, 10, 18, 21, 0)):
+        assert first_open_week(now.date()) == (43, 2026)
+        assert set(week_eligibility(make_slots(), 43, 2026, now).values()) == {None}
+        assert set(week_eligibility(make_slots(), 42, 2026, now).values()) == {"closed"}
+    assert first_open_week(datetime.date(2026, 10, 16)) == (42, 2026)
+
+def test_sunday_night_before_a_monday_midnight_course():
+    slot = make_slots()[0]
+    assert minutes_into_week(datetime.datetime(2026, 10, 18, 22, 0), 43, 2026) == -120
+    assert is_reservation_allowed(slot, 43, 2026, datetime.datetime(2026, 10, 18, 22, 0))
+    assert not is_reservation_allowed(slot, 43, 2026, datetime.datetime(2026, 10, 18, 22, 1))
+    assert week_eligibility([slot], 43, 2026, datetime.datetime(2026, 10, 18, 22, 1)) == {1: "closed"}
+
+def test_two_hour_boundary():
+    friday_course = make_slots()[4]
+    assert is_reservation_allowed(friday_course, 43, 2026, datetime.datetime(2026, 10, 23, 16, 0))
+    assert not is_reservation_allowed(friday_course, 43, 2026, datetime.datetime(2026, 10, 23, 16, 1))
+    eligibility = week_eligibility(make_slots(), 43, 2026, datetime.datetime(2026, 10, 23, 16, 1))
+    assert eligibility == {1: "closed", 2: "closed", 3: "closed", 4: "closed", 5: "closed"}
+    eligibility = week_eligibility(make_slots(), 43, 2026, datetime.datetime(2026, 10, 22, 16, 0))
+    assert eligibility == {1: "closed", 2: "closed", 3: "closed", 4: None, 5: None}
+
+def test_week_53_and_new_year():
+    # Week 53 of 2026 runs from Monday 28 December to Sunday 3 January 2027
+    now = datetime.datetime(2026, 12, 26, 12, 0)
+    assert first_open_week(now.date()) == (53, 2026)
+    assert minutes_into_week(now, 53, 2026) == -2 * 24 * 60 + 12 * 60
+    eligibility = week_eligibility(make_slots(), 53, 2026, now)
+    assert eligibility == {1: None, 2: None, 3: None, 4: None, 5: "bank_holiday"}
+    # Friday 1 January 2027 is a bank holiday even once the course is past
+    eligibility = week_eligibility(make_slots(), 53, 2026, datetime.datetime(2027, 1, 2, 9, 0))
+    assert eligibility[5] == "bank_holiday"
+    assert first_open_week(datetime.date(2027, 1, 2)) == (1, 2027)
+
+def test_club_closure():
+    now = datetime.datetime(2026, 10, 17, 12, 0)
+    closures = {datetime.date(2026, 10, 21)}
+    eligibility = week_eligibility(make_slots(), 43, 2026, now, closures)
+    assert eligibility == {1: None, 2: None, 3: "club_closed", 4: None, 5: None}
+
+def test_gym_douce_only():
+    now = datetime.datetime(2026, 10, 17, 12, 0)
+    assert week_eligibility(make_slots(), 43, 2026, now, gym_douce_only=True) == {3: None}
+    closures = {datetime.date(2026, 10, 21)}
+    assert week_eligibility(make_slots(), 43, 2026, now, closures, gym_douce_only=True) == {3: "club_closed"}